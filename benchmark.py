@@ -0,0 +1,608 @@
+#!/usr/bin/env python
+
+"""
+benchmark.py -- Load and regression benchmarks for the ConferenceApi;
+    runs every endpoint method against the App Engine testbed
+
+Seeds synthetic data at a configurable scale into the datastore, memcache
+and taskqueue stubs, drives every ConferenceApi method and reports latency,
+RPC counts and errors per method. Results are compared against a stored
+baseline, and the run fails when a method regresses (or when there is no
+baseline to compare against).
+
+    $ python benchmark.py --sdk ~/google_appengine
+    $ python benchmark.py --sdk ~/google_appengine --update-baseline
+    $ python benchmark.py --sdk ~/google_appengine --conferences 200 \\
+          --sessions-per-conference 20 --users 500
+
+With --imports it profiles the startup of an instance instead: the time it
+takes to import the app's modules, per module (including its own imports).
+
+    $ python benchmark.py --sdk ~/google_appengine --imports
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import date
+from datetime import time as dtime
+from datetime import timedelta
+
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(APP_ROOT, 'benchmark_baseline.json')
+
+# A method regresses when its median latency grows by more than
+# LATENCY_TOLERANCE (relative) *and* LATENCY_SLACK_MS (absolute), or when
+# it issues more RPCs than recorded in the baseline.
+LATENCY_TOLERANCE = 0.5
+LATENCY_SLACK_MS = 5.0
+# modules listed by the import profile
+IMPORT_PROFILE_TOP = 30
+
+CITIES = ['Amsterdam', 'London', 'Paris', 'Berlin', 'Chicago', 'Tokyo']
+TOPICS = ['Web', 'Mobile', 'Cloud', 'Data', 'Security', 'Design']
+SESSION_TYPES = ['WORKSHOP', 'LECTURE', 'KEYNOTE', 'LIGHTNING_TALK']
+
+
+def setup_sdk(sdk_path):
+    """ Put the App Engine SDK and its bundled libraries on sys.path
+    """
+    if sdk_path:
+        sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, APP_ROOT)
+
+
+class Bench(object):
+    """ Testbed with stubs, synthetic data and per-method measurements
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.rpcs = defaultdict(int)
+        self.counting = False
+
+    def setUp(self):
+        from google.appengine.api import apiproxy_stub_map
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import ndb
+        from google.appengine.ext import testbed
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # Endpoints takes the app revision from the version id
+        self.testbed.setup_env(app_id='ud858conferencecentral',
+                               current_version_id='benchmark.1',
+                               overwrite=True)
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=APP_ROOT)
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_user_stub()
+        self.testbed.init_urlfetch_stub()
+        ndb.get_context().clear_cache()
+
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'benchmark', self._countRpc)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _countRpc(self, service, call, request, response):
+        if self.counting:
+            self.rpcs['%s.%s' % (service, call)] += 1
+
+    def login(self, email):
+        """ Make endpoints.get_current_user() return the given user
+        """
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+        os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'example.com'
+
+# - - - Synthetic data - - - - - - - - - - - - - - - - - - - -
+
+    def seed(self):
+        """ Store synthetic data at the scale given on the command line
+        """
+        from google.appengine.ext import ndb
+        from models import Conference
+        from models import Profile
+        from models import Registration
+        from models import Session
+        from models import Speaker
+        from models import Wishlist
+
+        args = self.args
+        today = date.today()
+
+        self.users = ['user%d@example.com' % i for i in range(args.users)]
+        profiles = [Profile(key=ndb.Key(Profile, user_id),
+                            displayName='User %d' % i,
+                            mainEmail=user_id,
+                            teeShirtSize='NOT_SPECIFIED')
+                    for i, user_id in enumerate(self.users)]
+
+        speakers = [Speaker(name='Speaker %d' % i,
+                            twitter='@speaker%d' % i)
+                    for i in range(args.speakers)]
+        self.speakers = ndb.put_multi(speakers)
+
+        # one extra conference of the benchmark user per iteration, for the
+        # deleteConference scenario to take away
+        conferences = []
+        for i in range(args.conferences + args.iterations):
+            if i < args.conferences:
+                organizer = self.users[i % len(self.users)]
+            else:
+                organizer = self.users[0]
+            start = today + timedelta(days=(i % 180) - 60)
+            conferences.append(Conference(
+                parent=ndb.Key(Profile, organizer),
+                name='Conference %d' % i,
+                description='Synthetic conference %d' % i,
+                organizerUserId=organizer,
+                topics=[TOPICS[i % len(TOPICS)],
+                        TOPICS[(i + 1) % len(TOPICS)]],
+                city=CITIES[i % len(CITIES)],
+                startDate=start,
+                endDate=start + timedelta(days=2),
+                month=start.month,
+                maxAttendees=args.users,
+                seatsAvailable=args.users,
+                aggregated=True))
+        self.conferences = ndb.put_multi(conferences)
+        self.deletable = self.conferences[args.conferences:]
+
+        sessions = []
+        for c, conf_key in enumerate(self.conferences):
+            conf = conferences[c]
+            for s in range(args.sessions_per_conference):
+                sessions.append(Session(
+                    parent=conf_key,
+                    name='Session %d.%d' % (c, s),
+                    highlights='Synthetic session',
+                    duration=30 + 15 * (s % 4),
+                    typeOfSession=SESSION_TYPES[s % len(SESSION_TYPES)],
+                    date=conf.startDate + timedelta(days=s % 2),
+                    startTime=dtime(9 + s % 10, 0),
+                    speakers=[self.speakers[(c + s) % len(self.speakers)]]))
+        self.sessions = ndb.put_multi(sessions)
+
+        # registrations: every user attends a rotating window of conferences
+        registrations = []
+        for u, prof in enumerate(profiles):
+            for r in range(min(args.registrations, len(self.conferences))):
+                conf = conferences[(u + r) % len(conferences)]
+                prof.conferenceKeysToAttend.append(conf.key)
+                conf.seatsAvailable -= 1
+                registrations.append(Registration(
+                    parent=prof.key, id=conf.key.urlsafe(),
+                    conference=conf.key))
+        ndb.put_multi(profiles + conferences + registrations)
+
+        wishlists = []
+        for u, user_id in enumerate(self.users):
+            for w in range(min(args.wishlist_entries, len(self.sessions))):
+                wishlists.append(Wishlist(
+                    parent=ndb.Key(Profile, user_id),
+                    session=self.sessions[(u * 7 + w) % len(self.sessions)],
+                    counted=True))
+        ndb.put_multi(wishlists)
+
+        # the announcement is normally set by cron
+        from conference import AGGREGATE_GROUP
+        from conference import ConferenceApi
+        ConferenceApi._cacheAnnouncement()
+
+        # the aggregates are normally kept up to date by the API
+        import counters
+        deltas = None
+        memberships = set()
+        for conf in conferences:
+            deltas = ConferenceApi._getAggregateDeltas(
+                conf, 1, conf.seatsAvailable, deltas)
+            memberships.update(ConferenceApi._getAggregateValues(conf))
+        counters.addToGroups([(AGGREGATE_GROUP % dimension, value)
+                              for dimension, value in memberships])
+        counters.incrementCounters(deltas)
+
+        # wishlist counts, and the top sessions normally computed by cron
+        from conference import WISHLIST_COUNTER
+        from conference import WISHLIST_COUNTER_SHARDS
+        wishlisted = {}
+        for wishlist in wishlists:
+            name = WISHLIST_COUNTER % wishlist.session.urlsafe()
+            wishlisted[name] = wishlisted.get(name, 0) + 1
+        counters.incrementCounters(wishlisted, WISHLIST_COUNTER_SHARDS)
+        for conf_key in self.conferences:
+            ConferenceApi._storeTopSessions(conf_key)
+
+# - - - Scenarios - - - - - - - - - - - - - - - - - - - - - -
+
+    def scenarios(self):
+        """ Return (method name, callable(api, i)) pairs in execution order
+
+        Every ConferenceApi method has a scenario; read-only methods come
+        first so that they see the seeded data only.
+        """
+        from models import ConferenceQueryForm
+        from models import SessionQueryForm
+        from models import SpeakerEditForm
+
+        conf = lambda i: self.conferences[i % len(self.conferences)]
+        sess = lambda i: self.sessions[i % len(self.sessions)]
+        spkr = lambda i: self.speakers[i % len(self.speakers)]
+        # sessions after those seeded in the benchmark user's wishlist
+        unwished = lambda i: sess(self.args.wishlist_entries + i)
+
+        return [
+            ('getConference', lambda api, i: self.call(
+                api, 'getConference', websafeKey=conf(i).urlsafe())),
+            ('getConferencesByKeys', lambda api, i: self.call(
+                api, 'getConferencesByKeys',
+                websafeKeys=[conf(i + j).urlsafe() for j in range(10)])),
+            ('getSessionsByKeys', lambda api, i: self.call(
+                api, 'getSessionsByKeys',
+                websafeKeys=[sess(i + j).urlsafe() for j in range(10)])),
+            ('getChanges', lambda api, i: self.call(api, 'getChanges')),
+            ('getConferencesCreated', lambda api, i: self.call(
+                api, 'getConferencesCreated')),
+            ('queryConferences', lambda api, i: self.call(
+                api, 'queryConferences', filters=[
+                    ConferenceQueryForm(field='CITY', operator='EQ',
+                                        value=CITIES[i % len(CITIES)]),
+                    ConferenceQueryForm(field='MAX_ATTENDEES',
+                                        operator='GT', value='0')])),
+            ('getDashboard', lambda api, i: self.call(
+                api, 'getDashboard', filters=[
+                    ConferenceQueryForm(field='CITY', operator='EQ',
+                                        value=CITIES[i % len(CITIES)])])),
+            ('getUpcomingConferences', lambda api, i: self.call(
+                api, 'getUpcomingConferences')),
+            ('getNonWorkshopsBeforeSevenPM', lambda api, i: self.call(
+                api, 'getNonWorkshopsBeforeSevenPM')),
+            ('querySessions', lambda api, i: self.call(
+                api, 'querySessions', filters=[
+                    SessionQueryForm(field='SPEAKER', operator='EQ',
+                                     value=spkr(i).urlsafe()),
+                    SessionQueryForm(field='START_TIME', operator='GTEQ',
+                                     value='10:00'),
+                    SessionQueryForm(field='TYPE', operator='NE',
+                                     value='WORKSHOP')])),
+            ('getConferencesNotSoldOutInAmsterdam', lambda api, i: self.call(
+                api, 'getConferencesNotSoldOutInAmsterdam')),
+            ('getFeaturedSpeaker', lambda api, i: self.call(
+                api, 'getFeaturedSpeaker', websafeKey=conf(i).urlsafe())),
+            ('getConferenceSessions', lambda api, i: self.call(
+                api, 'getConferenceSessions', websafeKey=conf(i).urlsafe())),
+            ('getConferenceTimetable', lambda api, i: self.call(
+                api, 'getConferenceTimetable', websafeKey=conf(i).urlsafe())),
+            ('getConferenceSessionsByType', lambda api, i: self.call(
+                api, 'getConferenceSessionsByType',
+                websafeConferenceKey=conf(i).urlsafe(),
+                typeOfSession=SESSION_TYPES[i % len(SESSION_TYPES)])),
+            ('getSessionsBySpeaker', lambda api, i: self.call(
+                api, 'getSessionsBySpeaker', speaker=spkr(i).urlsafe())),
+            ('getSpeakers', lambda api, i: self.call(api, 'getSpeakers')),
+            ('getProfile', lambda api, i: self.call(api, 'getProfile')),
+            ('getConferenceAttendees', lambda api, i: self.call(
+                api, 'getConferenceAttendees',
+                websafeKey=self.own_conference.urlsafe())),
+            ('getConferenceAttendeeCount', lambda api, i: self.call(
+                api, 'getConferenceAttendeeCount',
+                websafeKey=conf(i).urlsafe())),
+            ('getTopSessions', lambda api, i: self.call(
+                api, 'getTopSessions', websafeKey=conf(i).urlsafe())),
+            ('getConferenceStats', lambda api, i: self.call(
+                api, 'getConferenceStats',
+                dimension=('city', 'topic', 'month')[i % 3])),
+            ('getSessionsInWishlist', lambda api, i: self.call(
+                api, 'getSessionsInWishlist')),
+            ('getWishlistConflicts', lambda api, i: self.call(
+                api, 'getWishlistConflicts')),
+            ('getAnnouncement', lambda api, i: self.call(
+                api, 'getAnnouncement')),
+            ('getConferencesToAttend', lambda api, i: self.call(
+                api, 'getConferencesToAttend')),
+            ('saveProfile', lambda api, i: self.call(
+                api, 'saveProfile', displayName='Benchmark %d' % i)),
+            ('createConference', lambda api, i: self.call(
+                api, 'createConference', name='New conference %d' % i,
+                city=CITIES[i % len(CITIES)], maxAttendees=100,
+                startDate=str(date.today() + timedelta(days=30)),
+                endDate=str(date.today() + timedelta(days=31)))),
+            ('updateConference', lambda api, i: self.call(
+                api, 'updateConference',
+                websafeConferenceKey=self.own_conference.urlsafe(),
+                description='Updated %d' % i)),
+            ('createSpeaker', lambda api, i: self.call(
+                api, 'createSpeaker', name='New speaker %d' % i)),
+            ('createSession', lambda api, i: self.call(
+                api, 'createSession',
+                websafeConferenceKey=self.own_conference.urlsafe(),
+                name='New session %d' % i, startTime='10:00',
+                date=str(date.today() + timedelta(days=30)),
+                speakers=[spkr(i).urlsafe()])),
+            ('addSpeakerToSession', lambda api, i: self.call(
+                api, 'addSpeakerToSession',
+                websafeSessionKey=sess(i).urlsafe(),
+                websafeSpeakerKey=spkr(i + 1).urlsafe())),
+            ('removeSpeakerFromSession', lambda api, i: self.call(
+                api, 'removeSpeakerFromSession',
+                websafeSessionKey=sess(i).urlsafe(),
+                websafeSpeakerKey=spkr(i + 1).urlsafe())),
+            ('updateSessionSpeakers', lambda api, i: self.call(
+                api, 'updateSessionSpeakers', edits=[
+                    SpeakerEditForm(websafeSessionKey=sess(i + j).urlsafe(),
+                                    websafeSpeakerKey=spkr(i + j).urlsafe(),
+                                    add=bool(j % 2))
+                    for j in range(10)])),
+            ('createWishlist', lambda api, i: self.call(
+                api, 'createWishlist',
+                websafeKey=unwished(i).urlsafe())),
+            ('addSessionToWishlist', lambda api, i: self.call(
+                api, 'addSessionToWishlist',
+                websafeKey=unwished(self.args.iterations + i).urlsafe())),
+            ('deleteSessionInWishlist', lambda api, i: self.call(
+                api, 'deleteSessionInWishlist',
+                websafeKey=unwished(self.args.iterations + i).urlsafe())),
+            ('registerForConference', lambda api, i: self.call(
+                api, 'registerForConference',
+                websafeKey=self.free_conference(i).urlsafe())),
+            ('unregisterFromConference', lambda api, i: self.call(
+                api, 'unregisterFromConference',
+                websafeKey=self.free_conference(i).urlsafe())),
+            # last, as it takes conferences (of the benchmark user) away
+            ('deleteConference', lambda api, i: self.call(
+                api, 'deleteConference',
+                websafeKey=self.deletable[i].urlsafe())),
+        ]
+
+    def free_conference(self, i):
+        """ Return a conference the benchmark user is not attending yet
+        """
+        return self.conferences[
+            (self.args.registrations + i) % len(self.conferences)]
+
+    @staticmethod
+    def call(api, method_name, **fields):
+        """ Invoke an endpoints method the way the SPI layer would
+        """
+        method = getattr(api, method_name)
+        request = method.remote.request_type(**fields)
+        return method(request)
+
+# - - - Measurements - - - - - - - - - - - - - - - - - - - - -
+
+    def run(self):
+        from google.appengine.ext import ndb
+        import endpoints
+        from conference import ConferenceApi
+
+        self.login(self.users[0])
+        api = ConferenceApi()
+        # a conference owned by the benchmark user, for write scenarios
+        self.own_conference = self.conferences[0]
+
+        scenarios = self.scenarios()
+        covered = set(name for name, _ in scenarios)
+        missing = sorted(set(ConferenceApi.all_remote_methods()) - covered)
+
+        results = {}
+        for name, scenario in scenarios:
+            latencies = []
+            rpcs = defaultdict(int)
+            errors = 0
+            for i in range(self.args.iterations):
+                # start every call from a cold in-context cache, like a
+                # fresh request would
+                ndb.get_context().clear_cache()
+                self.rpcs.clear()
+                self.counting = True
+                start = time.time()
+                try:
+                    scenario(api, i)
+                except endpoints.ServiceException:
+                    errors += 1
+                finally:
+                    latencies.append((time.time() - start) * 1000.0)
+                    self.counting = False
+                for rpc, count in self.rpcs.items():
+                    rpcs[rpc] += count
+            latencies.sort()
+            results[name] = {
+                'median_ms': round(latencies[len(latencies) // 2], 3),
+                'max_ms': round(latencies[-1], 3),
+                'rpcs': int(round(
+                    sum(rpcs.values()) / float(self.args.iterations))),
+                'rpcs_by_call': dict(
+                    (k, v // self.args.iterations) for k, v in rpcs.items()),
+                'errors': errors,
+            }
+        return results, missing
+
+
+def compare(results, baseline):
+    """ Return a list of regression descriptions (empty when all is well)
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        limit = max(base['median_ms'] * (1 + LATENCY_TOLERANCE),
+                    base['median_ms'] + LATENCY_SLACK_MS)
+        if result['median_ms'] > limit:
+            regressions.append('%s: median %.1fms > %.1fms (baseline %.1fms)'
+                               % (name, result['median_ms'], limit,
+                                  base['median_ms']))
+        if result['rpcs'] > base['rpcs']:
+            regressions.append('%s: %d RPCs > baseline %d'
+                               % (name, result['rpcs'], base['rpcs']))
+        if result['errors'] > base.get('errors', 0):
+            regressions.append('%s: %d errors > baseline %d'
+                               % (name, result['errors'],
+                                  base.get('errors', 0)))
+    return regressions
+
+
+def report(results, baseline):
+    row = '%-38s %10s %10s %6s %10s %6s'
+    print(row % ('method', 'median ms', 'base ms', 'rpcs', 'base rpcs',
+                 'errors'))
+    for name, result in sorted(results.items()):
+        base = baseline.get(name, {})
+        print(row % (name, '%.2f' % result['median_ms'],
+                     '%.2f' % base['median_ms'] if base else '-',
+                     result['rpcs'],
+                     base['rpcs'] if base else '-',
+                     result['errors']))
+
+
+def profile_imports():
+    """ Import the app as a new instance does, and print the slowest modules
+
+    Times are cumulative: a module's time includes the modules it imports
+    first. Modules the SDK loaded before the app (like the runtime) aren't
+    counted, as on App Engine.
+    """
+    try:
+        import __builtin__ as builtins
+    except ImportError:
+        import builtins
+    real_import = builtins.__import__
+    timings = []
+    depth = [0]
+
+    def timed_import(name, *args, **kwargs):
+        loaded = len(sys.modules)
+        started = time.time()
+        depth[0] += 1
+        try:
+            return real_import(name, *args, **kwargs)
+        finally:
+            depth[0] -= 1
+            if len(sys.modules) > loaded:
+                # from ... import ...: name the imported submodules too
+                fromlist = args[2] if len(args) > 2 else kwargs.get(
+                    'fromlist')
+                if fromlist:
+                    name = '%s (%s)' % (name, ', '.join(fromlist))
+                timings.append(((time.time() - started) * 1000, depth[0],
+                                name))
+
+    os.environ.setdefault('APPLICATION_ID', 'ud858conferencecentral')
+    loaded = len(sys.modules)
+    builtins.__import__ = timed_import
+    started = time.time()
+    try:
+        import main  # imports conference.py, which builds the API server
+    finally:
+        builtins.__import__ = real_import
+    total = (time.time() - started) * 1000
+
+    print('%-60s %10s %6s' % ('module', 'ms', 'depth'))
+    for elapsed, level, name in sorted(timings,
+                                       reverse=True)[:IMPORT_PROFILE_TOP]:
+        print('%-60s %10.1f %6d' % (name, elapsed, level))
+    print('\n%d modules imported in %.1f ms' % (len(sys.modules) - loaded,
+                                                total))
+    return 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'),
+                        help='path to the App Engine Python SDK')
+    parser.add_argument('--conferences', type=int, default=50)
+    parser.add_argument('--sessions-per-conference', type=int, default=10)
+    parser.add_argument('--speakers', type=int, default=40)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--wishlist-entries', type=int, default=5,
+                        help='wishlist entries per user')
+    parser.add_argument('--registrations', type=int, default=3,
+                        help='conference registrations per user')
+    parser.add_argument('--iterations', type=int, default=10,
+                        help='calls per method')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store this run as the new baseline')
+    parser.add_argument('--json', help='also write results to this file')
+    parser.add_argument('--imports', action='store_true',
+                        help='profile the import time of the app instead')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    setup_sdk(args.sdk)
+    if args.imports:
+        return profile_imports()
+
+    bench = Bench(args)
+    bench.setUp()
+    try:
+        bench.seed()
+        results, missing = bench.run()
+    finally:
+        bench.tearDown()
+
+    scale = dict((k, v) for k, v in vars(args).items()
+                 if k not in ('sdk', 'baseline', 'update_baseline', 'json',
+                              'imports'))
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if stored.get('scale') == scale:
+            baseline = stored.get('methods', {})
+        else:
+            print('Baseline was recorded at a different scale (%s); '
+                  'not comparing.\n' % stored.get('scale'))
+    else:
+        print('No baseline at %s; not comparing.\n' % args.baseline)
+
+    report(results, baseline)
+    import cache
+    print('\nEntity cache hits per tier: %s' % ', '.join(
+        '%s %d' % tier for tier in sorted(cache.getStats().items())))
+    import fallback
+    print('Read responses: %s' % ', '.join(
+        '%s %d' % stat for stat in sorted(fallback.getStats().items())))
+    if missing:
+        print('\nNo scenario for: %s' % ', '.join(missing))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'scale': scale, 'methods': results}, f, indent=2,
+                      sort_keys=True)
+        print('\nBaseline written to %s' % args.baseline)
+        return 0
+
+    if not baseline:
+        print('\nNothing to compare against; record a baseline at this '
+              'scale with --update-baseline.')
+        return 1
+    regressions = compare(results, baseline)
+    if regressions:
+        print('\nRegressions:\n  %s' % '\n  '.join(regressions))
+        return 1
+    if missing:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
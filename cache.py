@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Udacity conference server-side Python App Engine two-tier entity cache
+
+Rarely changing entities (like speakers and conferences) and values derived
+from them are kept in a bounded LRU in instance memory, in front of memcache
+and the datastore. Every cached item has a version counter in memcache,
+which is incremented when the item is invalidated. An instance trusts its
+own copy of an item for VERSION_CHECK_INTERVAL seconds, and after that
+checks the version once per interval (for all items of a lookup in a single
+memcache get_multi, together with the memcache tier). Items are dropped
+after LOCAL_TTL seconds regardless, so a lost version counter costs at most
+one TTL of staleness.
+
+Cached entities are shared between the requests of an instance, so they
+must be treated as read-only: get them from the datastore to modify them.
+
+$Id$
+
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+LOCAL_MAX_ITEMS = 2000
+LOCAL_TTL = 300
+VERSION_CHECK_INTERVAL = 5
+MEMCACHE_TTL = 3600
+MEMCACHE_VERSION_KEY_PREFIX = "CACHE_VERSION_"
+MEMCACHE_ITEM_KEY_PREFIX = "CACHE_ITEM_"
+
+# cache id -> (value, version, checked at, expires at), least recently
+# used first
+_local = OrderedDict()
+_lock = threading.Lock()
+_stats = {'local': 0, 'memcache': 0, 'datastore': 0}
+
+
+def _cacheId(key):
+    return key.urlsafe() if isinstance(key, ndb.Key) else key
+
+
+def _newVersion():
+    # a version that was never handed out before
+    return int(time.time() * 1000000)
+
+
+def _getItems(cache_ids, load):
+    """Return a dict of cached values, loading the missing ones with load
+
+    load is called with a list of cache ids, and returns a dict with the
+    values of those that exist.
+    """
+    now = time.time()
+    found = {}
+    unchecked = {}
+    with _lock:
+        for cache_id in cache_ids:
+            item = _local.get(cache_id)
+            if not item or item[3] <= now:
+                continue
+            if now < item[2] + VERSION_CHECK_INTERVAL:
+                found[cache_id] = item[0]
+                _local[cache_id] = _local.pop(cache_id)
+            else:
+                unchecked[cache_id] = item
+        _stats['local'] += len(found)
+
+    missing = [cache_id for cache_id in cache_ids if cache_id not in found]
+    if not missing:
+        return found
+
+    # versions of all missing items, and the memcache tier of the items
+    # that aren't in instance memory
+    cached = memcache.get_multi(
+        [MEMCACHE_VERSION_KEY_PREFIX + cache_id for cache_id in missing] +
+        [MEMCACHE_ITEM_KEY_PREFIX + cache_id for cache_id in missing
+         if cache_id not in unchecked])
+    versions = {}
+    new_versions = {}
+    for cache_id in missing:
+        version = cached.get(MEMCACHE_VERSION_KEY_PREFIX + cache_id)
+        if version is None:
+            version = new_versions[cache_id] = _newVersion()
+        versions[cache_id] = version
+    if new_versions:
+        memcache.add_multi(new_versions,
+                           key_prefix=MEMCACHE_VERSION_KEY_PREFIX)
+
+    fresh = {}
+    hits = {'local': 0, 'memcache': 0}
+    for cache_id in missing:
+        item = unchecked.get(cache_id)
+        stored = cached.get(MEMCACHE_ITEM_KEY_PREFIX + cache_id)
+        if item and item[1] == versions[cache_id]:
+            fresh[cache_id] = item[0]
+            hits['local'] += 1
+        elif stored and stored[0] == versions[cache_id]:
+            fresh[cache_id] = stored[1]
+            hits['memcache'] += 1
+
+    to_load = [cache_id for cache_id in missing if cache_id not in fresh]
+    loaded = load(to_load) if to_load else {}
+    if loaded:
+        memcache.set_multi(
+            {cache_id: (versions[cache_id], value)
+             for cache_id, value in loaded.items()},
+            time=MEMCACHE_TTL, key_prefix=MEMCACHE_ITEM_KEY_PREFIX)
+    fresh.update(loaded)
+
+    with _lock:
+        for cache_id, value in fresh.items():
+            item = unchecked.get(cache_id)
+            expires = (item[3] if item and item[0] is value
+                       else now + LOCAL_TTL)
+            _local.pop(cache_id, None)
+            _local[cache_id] = (value, versions[cache_id], now, expires)
+        for cache_id in set(unchecked) - set(fresh):
+            _local.pop(cache_id, None)
+        while len(_local) > LOCAL_MAX_ITEMS:
+            _local.popitem(last=False)
+        _stats['local'] += hits['local']
+        _stats['memcache'] += hits['memcache']
+        _stats['datastore'] += len(to_load)
+
+    found.update(fresh)
+    return found
+
+
+def getMulti(keys):
+    """Return the entities of a list of keys, with None for missing ones"""
+    def load(cache_ids):
+        entities = ndb.get_multi([ndb.Key(urlsafe=cache_id)
+                                  for cache_id in cache_ids])
+        return {cache_id: entity for cache_id, entity
+                in zip(cache_ids, entities) if entity}
+
+    found = _getItems([key.urlsafe() for key in keys], load)
+    return [found.get(key.urlsafe()) for key in keys]
+
+
+def get(key):
+    """Return the entity of a key, or None"""
+    return getMulti([key])[0]
+
+
+def getValue(name, compute):
+    """Return a named value, computed (by calling compute) when not cached
+
+    The value is invalidated by name, like invalidate(name).
+    """
+    return _getItems([name], lambda names: {name: compute()})[name]
+
+
+def invalidate(*keys):
+    """Invalidate the cached items of entity keys or value names
+
+    Within a transaction the items are invalidated once it has committed.
+    """
+    cache_ids = [_cacheId(key) for key in keys]
+
+    def bump():
+        with _lock:
+            for cache_id in cache_ids:
+                _local.pop(cache_id, None)
+        memcache.offset_multi({cache_id: 1 for cache_id in cache_ids},
+                              key_prefix=MEMCACHE_VERSION_KEY_PREFIX,
+                              initial_value=_newVersion())
+    ndb.get_context().call_on_commit(bump)
+
+
+def getStats():
+    """Return the number of hits per tier of this instance
+
+    'datastore' counts the items that were loaded (or computed).
+    """
+    with _lock:
+        return dict(_stats)
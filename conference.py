@@ -12,45 +12,84 @@ created by wesc on 2014 apr 21
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+from collections import defaultdict
+from collections import OrderedDict
 from datetime import datetime
 from datetime import timedelta
+import base64
 import json
+import operator
+import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
 
+import cache
+import counters
+import fallback
+
+from models import AttendeeForm
+from models import AttendeeForms
+from models import BooleanMessage
 from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import StringMessage
-from models import BooleanMessage
+from models import IntegerMessage
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForms
+from models import ConferenceResultForm
+from models import ConferenceResultForms
+from models import ConferenceStatForm
+from models import ChangesForm
+from models import ConferenceStatForms
+from models import DashboardForm
+from models import DeletedForm
+from models import Registration
+from models import RegistrationMessage
 from models import Session
+from models import SessionConflictForm
+from models import SessionConflictForms
 from models import SessionForm
 from models import SessionForms
+from models import SessionQueryForms
+from models import SessionResultForm
+from models import SessionResultForms
 from models import SessionType
 from models import Wishlist
 from models import WishlistForm
 from models import Speaker
+from models import SpeakerEditForms
 from models import SpeakerForm
 from models import SpeakerForms
+from models import SpeakerMiniForm
 from models import TeeShirtSize
+from models import Timetable
+from models import Tombstone
+from models import TooManyRequestsException
+from models import TopSessions
+from models import WaitlistEntry
+from models import WebsafeKeysMessage
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
+from settings import RATE_LIMITS
 
+from utils import countRpcs
 from utils import getUserId
 
 import logging
@@ -65,8 +104,46 @@ EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 MEMCACHE_FEATURED_KEY_PREFIX = "FEATURED_SPEAKER_"
+CACHE_SPEAKER_INDEX = "speaker-index"
+# websafe keys in the speaker index, well within a Memcache value
+SPEAKER_INDEX_MAX_KEYS = 5000
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+CONFIRMATION_EMAIL_QUEUE = "confirmation-email"
+MEMCACHE_COUNTER_KEY_PREFIX = "COUNTER_"
+MEMCACHE_VERSION_KEY_PREFIX = "VERSION_"
+MEMCACHE_TIMETABLE_KEY_PREFIX = "TIMETABLE_"
+MEMCACHE_TOP_SESSIONS_KEY_PREFIX = "TOP_SESSIONS_"
+MEMCACHE_RATE_LIMIT_KEY_PREFIX = "RATE_LIMIT_"
+RATE_LIMIT_CAS_RETRIES = 3
+ATTENDEES_COUNTER = "attendees:%s"
+ATTENDEES_PAGE_SIZE = 100
+ATTENDEES_MAX_PAGE_SIZE = 1000
+# conference aggregates: counter name from (measure, dimension, value), and
+# the counter group that lists the values of a dimension
+AGGREGATE_COUNTER = u"aggregate:%s:%s:%s"
+AGGREGATE_GROUP = "aggregate:%s"
+AGGREGATE_DIMENSIONS = ('city', 'topic', 'month')
+# Changes within this many seconds share one featured speaker recomputation
+FEATURED_SPEAKERS_WINDOW = 10
+# ... and one rebuild of the timetable
+TIMETABLE_WINDOW = 10
+# ... and one promotion from the waitlist, after someone joined it
+PROMOTE_WINDOW = 5
+# number of current and upcoming conferences primed by the warmup request
+WARMUP_CONFERENCES = 20
+ARCHIVE_BATCH_SIZE = 50
+# the stages of deleting a conference, in order
+DELETE_STAGES = ('wishlists', 'sessions', 'registrations', 'waitlist',
+                 'conference')
+DELETE_BATCH_SIZE = 100
+# sessions whose wishlist entries are deleted per batch
+DELETE_WISHLIST_SESSIONS = 20
+# wishlist counters are per session, and rarely hot
+WISHLIST_COUNTER = "wishlist:%s"
+WISHLIST_COUNTER_SHARDS = 5
+TOP_SESSIONS = 10
+TOP_SESSIONS_BATCH_SIZE = 20
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -98,6 +175,52 @@ FIELDS = {
     'MAX_ATTENDEES': 'maxAttendees',
 }
 
+SESSION_FIELDS = {
+    'CONFERENCE': 'conference',
+    'SPEAKER': 'speakers',
+    'TYPE': 'typeOfSession',
+    'DATE': 'date',
+    'START_TIME': 'startTime',
+    'END_TIME': 'endTime',
+    'DURATION': 'duration',
+}
+
+# The session query planner sends the filter with the lowest rank to the
+# datastore; ranks are keyed by field, and whether it's an equality filter
+SESSION_FILTER_RANKS = {
+    ('conference', True): 0,
+    ('speakers', True): 1,
+    ('date', True): 2,
+    ('startTime', True): 3,
+    ('endTime', True): 3,
+    ('date', False): 4,
+    ('startTime', False): 5,
+    ('endTime', False): 5,
+    ('duration', True): 6,
+    ('typeOfSession', True): 7,
+    ('duration', False): 8,
+    ('typeOfSession', False): 9,
+}
+
+COMPARATORS = {
+    '=': operator.eq,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '!=': operator.ne,
+}
+
+SESSION_QUERY_LIMIT = 100
+SESSION_QUERY_MAX_LIMIT = 1000
+BATCH_GET_MAX_KEYS = 100
+CHANGES_PAGE_SIZE = 100
+# writes of the last seconds are returned again by the next page, in case
+# they are committed (or indexed) after later ones were handed out
+CHANGES_OVERLAP_SECONDS = 30
+CHANGES_EPOCH = datetime(1970, 1, 1)
+TOKEN_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -112,6 +235,7 @@ SESSION_GET_REQUEST_FILTERED = endpoints.ResourceContainer(
 SESSION_GET_REQUEST_SPEAKER = endpoints.ResourceContainer(
     message_types.VoidMessage,
     speaker=messages.StringField(1),
+    includeArchived=messages.BooleanField(2),
 )
 
 SESSION_POST_REQUEST = endpoints.ResourceContainer(
@@ -124,6 +248,34 @@ GENERIC_WEBSAFEKEY_REQUEST = endpoints.ResourceContainer(
     websafeKey=messages.StringField(1, required=True),
 )
 
+CONDITIONAL_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
+CONDITIONAL_WEBSAFEKEY_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeKey=messages.StringField(1, required=True),
+    ifNoneMatch=messages.StringField(2),
+)
+
+ATTENDEES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeKey=messages.StringField(1, required=True),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
+STATS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    dimension=messages.StringField(1, required=True),
+)
+
+CHANGES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    token=messages.StringField(1),
+)
+
 SESSION_POST_REQUEST_MODIFY_SPEAKERS = endpoints.ResourceContainer(
     websafeSessionKey=messages.StringField(1, required=True),
     websafeSpeakerKey=messages.StringField(2, required=True),
@@ -147,6 +299,148 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization Required')
         return user
 
+    @staticmethod
+    def _incrCounter(name, delta=1):
+        """ Increment a named counter in memcache
+        """
+        memcache.incr(MEMCACHE_COUNTER_KEY_PREFIX+name, delta=delta,
+                      initial_value=0)
+
+    @staticmethod
+    def _getCounters(names):
+        """ Return a dict with the current values of named counters
+        """
+        values = memcache.get_multi(names,
+                                    key_prefix=MEMCACHE_COUNTER_KEY_PREFIX)
+        return {name: int(values.get(name, 0)) for name in names}
+
+    @staticmethod
+    def _enqueueCoalesced(url, conf_wsk, window):
+        """ Enqueue a task for a conference at most once per time window
+
+        The task is named after its url, the conference and the current
+        window, and it is delayed until the window has passed, so it picks
+        up every change made in that window. Adding a task with the same
+        name fails, and is counted as a suppressed task instead.
+        """
+        bucket = int(time.time() // window)
+        task_name = '{}-{}-{}'.format(
+            url.strip('/').replace('/', '-'), conf_wsk, bucket)
+        counter = url.strip('/').split('/')[-1]
+        try:
+            taskqueue.add(name=task_name, url=url,
+                          params={'conf_wsk': conf_wsk},
+                          countdown=(bucket + 1) * window - time.time())
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            ConferenceApi._incrCounter(counter + '_suppressed')
+            return False
+        ConferenceApi._incrCounter(counter + '_enqueued')
+        return True
+
+    @staticmethod
+    def _bumpVersions(*scopes):
+        """ Increment the generation counters of the given scopes
+
+        Scopes name versioned resources, like 'conference:<wsk>'. Within a
+        transaction the counters are incremented once it has committed, so
+        a stamp never refers to uncommitted data.
+        """
+        def bump():
+            memcache.offset_multi(
+                {scope: 1 for scope in scopes},
+                key_prefix=MEMCACHE_VERSION_KEY_PREFIX,
+                initial_value=int(time.time() * 1000000))
+        ndb.get_context().call_on_commit(bump)
+
+    def _getEtag(self, request, *scopes):
+        """ Return the ETag of a resource, and whether the client has it
+
+        The ETag is made of the generation counters of the given scopes, so
+        it can be checked without loading any entity. Counters that are not
+        in memcache (anymore) start at the current time in microseconds, so
+        they never match a stamp handed out before. The client's stamp is
+        taken from the ifNoneMatch field or the If-None-Match header.
+        """
+        versions = memcache.get_multi(
+            scopes, key_prefix=MEMCACHE_VERSION_KEY_PREFIX)
+        missing = {scope: int(time.time() * 1000000)
+                   for scope in scopes if scope not in versions}
+        if missing:
+            memcache.add_multi(missing,
+                               key_prefix=MEMCACHE_VERSION_KEY_PREFIX)
+            versions.update(missing)
+        etag = '"{}"'.format('.'.join(str(versions[scope])
+                                      for scope in scopes))
+
+        if_none_match = getattr(request, 'ifNoneMatch', None)
+        if not if_none_match:
+            headers = getattr(getattr(self, 'request_state', None),
+                              'headers', None)
+            if_none_match = headers and headers.get('If-None-Match')
+        return etag, etag == if_none_match
+
+    def _checkRateLimit(self, method):
+        """ Take a token from the caller's bucket for a method, if limited
+
+        Callers are users, or the client address for unauthenticated
+        calls. A bucket holds up to the calls of RATE_LIMITS, and is
+        refilled continuously at calls per seconds. It is kept in memcache
+        as (tokens, refilled at) and updated with gets and cas, so
+        concurrent instances share it; a bucket that expired was full.
+        When memcache is unavailable, or the bucket stays contended for
+        RATE_LIMIT_CAS_RETRIES attempts, calls are let through.
+        """
+        limit = RATE_LIMITS.get(method)
+        if not limit:
+            return
+        calls, seconds = limit
+        user = endpoints.get_current_user()
+        if user:
+            caller = getUserId(user)
+        else:
+            caller = getattr(getattr(self, 'request_state', None),
+                             'remote_address', None) or 'anonymous'
+
+        client = memcache.Client()
+        key = u'{}{}:{}'.format(MEMCACHE_RATE_LIMIT_KEY_PREFIX, method,
+                                caller)
+        for _ in range(RATE_LIMIT_CAS_RETRIES):
+            now = time.time()
+            bucket = client.gets(key)
+            if bucket is None:
+                if client.add(key, (calls - 1, now), time=seconds):
+                    return
+                continue
+            tokens, refilled = bucket
+            tokens = min(calls, tokens + (now - refilled) * calls / seconds)
+            if tokens < 1:
+                ConferenceApi._incrCounter('throttled_' + method)
+                logging.warning('Throttled %s for %s', method, caller)
+                raise TooManyRequestsException(
+                    'Rate limit of %d calls per %d seconds exceeded' %
+                    (calls, seconds))
+            if client.cas(key, (tokens - 1, now), time=seconds):
+                return
+
+    @staticmethod
+    def _parseWebsafeKeys(websafeKeys, kind):
+        """ Return the keys of a list of websafe keys, with None for the
+        ones that are invalid or of another kind
+        """
+        if len(websafeKeys) > BATCH_GET_MAX_KEYS:
+            raise endpoints.BadRequestException(
+                'At most {} keys can be requested at once'.format(
+                    BATCH_GET_MAX_KEYS))
+        keys = []
+        for wsk in websafeKeys:
+            try:
+                key = ndb.Key(urlsafe=wsk)
+            except (TypeError, ValueError, ProtocolBufferDecodeError):
+                key = None
+            keys.append(key if key and key.kind() == kind else None)
+        return keys
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
     def _copyConferenceToForm(self, conf, displayName):
@@ -185,6 +479,8 @@ class ConferenceApi(remote.Service):
                 for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # add default values for those missing
         # (both data model & outbound Message)
@@ -216,17 +512,56 @@ class ConferenceApi(remote.Service):
         conf_key = ndb.Key(Conference, conf_id, parent=prof_key)
         data['key'] = conf_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        data['aggregated'] = True
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-                              'conferenceInfo': repr(request)},
-                      url='/tasks/send_confirmation_email')
+        conf = Conference(**data)
+        self._putNewConference(conf)
+        self._queueConfirmationEmail(
+            user.email(), u'Conference: {} ({}, {} - {})'.format(
+                request.name, request.city, request.startDate or '?',
+                request.endDate or '?'))
         return request
 
+    @staticmethod
     @ndb.transactional()
+    def _putNewConference(conf):
+        """ Store a new Conference, and have it counted in its aggregates
+        """
+        conf.put()
+        ConferenceApi._queueAggregates(
+            ConferenceApi._getAggregateDeltas(conf, 1,
+                                              conf.seatsAvailable or 0),
+            conf)
+
+    @staticmethod
+    def _queueConfirmationEmail(email, summary):
+        """ Queue a summary line for the next confirmation digest of a user
+
+        The lines end up in a pull queue, tagged with the recipient, so the
+        mail worker can lease all lines of one recipient at once and send
+        them as a single digest.
+        """
+        taskqueue.Queue(CONFIRMATION_EMAIL_QUEUE).add(
+            taskqueue.Task(payload=summary.encode('utf-8'), method='PULL',
+                           tag=email),
+            transactional=ndb.in_transaction())
+
     def _updateConferenceObject(self, request):
+        """ Update a Conference, and the aggregates it counts towards
+        """
+        conf = self._updateConferenceEntity(request)
+        prof = ndb.Key(Profile, conf.organizerUserId).get()
+        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+
+    @ndb.transactional()
+    def _updateConferenceEntity(self, request):
+        """ Update a Conference from a ConferenceForm in a transaction
+
+        Returns the Conference; the changes to its aggregates are applied
+        by a task that commits with it.
+        """
         user = self.get_authed_user()
         user_id = getUserId(user)
 
@@ -237,7 +572,7 @@ class ConferenceApi(remote.Service):
         # update existing conference
         conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
         # check that conference exists
-        if not conf:
+        if not conf or conf.deleted:
             raise endpoints.NotFoundException(
                 'No conference found with key: {}'.format(
                     request.websafeConferenceKey)
@@ -248,9 +583,16 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        # take the conference out of its aggregates, and put it back in
+        # once updated
+        deltas = self._getAggregateDeltas(conf, -1,
+                                          -(conf.seatsAvailable or 0))
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            if field.name in ('etag', 'notModified'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -262,8 +604,16 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(conf, field.name, data)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        self._bumpVersions('conference:' + request.websafeConferenceKey)
+        cache.invalidate(conf.key)
+        if request.seatsAvailable:
+            # seats may have been added for users on the waitlist
+            taskqueue.add(params={'conf_wsk': request.websafeConferenceKey},
+                          url='/tasks/promote_waitlist', transactional=True)
+        self._queueAggregates(
+            self._getAggregateDeltas(conf, 1, conf.seatsAvailable or 0,
+                                     deltas), conf)
+        return conf
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
                       http_method='POST', name='createConference')
@@ -282,19 +632,114 @@ class ConferenceApi(remote.Service):
         """
         return self._updateConferenceObject(request)
 
-    @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, ConferenceForm,
+    @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, BooleanMessage,
+                      path='conference/{websafeKey}',
+                      http_method='DELETE', name='deleteConference')
+    def deleteConference(self, request):
+        """ Delete a conference, with its sessions and references to it
+
+        The conference is marked deleted (and archived, so it drops out of
+        the queries) right away; its sessions, the wishlist entries and
+        registrations that refer to it and its caches are removed by
+        tasks, see _deleteConferenceBatch().
+        """
+        user_id = getUserId(self.get_authed_user())
+        self._markConferenceDeleted(request.websafeKey, user_id)
+        return BooleanMessage(data=True)
+
+    @ndb.transactional()
+    def _markConferenceDeleted(self, wsck, user_id):
+        """ Mark a conference deleted, and start removing it (and taking it
+        out of its aggregates)
+        """
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf or conf.deleted:
+            raise endpoints.NotFoundException(
+                'No conference found with key: {}'.format(wsck))
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can delete the conference.')
+
+        conf.deleted = True
+        conf.archived = True
+        conf.put()
+        self._bumpVersions('conference:' + wsck, 'sessions:' + wsck)
+        cache.invalidate(conf.key)
+
+        def forget():
+            # so reads that fail over don't serve the conference anymore
+            fallback.forget('conference', wsck)
+            fallback.forget('sessions', wsck)
+        ndb.get_context().call_on_commit(forget)
+        taskqueue.add(params={'conf_wsk': wsck, 'stage': DELETE_STAGES[0]},
+                      url='/tasks/delete_conference', transactional=True)
+        self._queueAggregates(self._getAggregateDeltas(
+            conf, -1, -(conf.seatsAvailable or 0)))
+
+    @endpoints.method(CONDITIONAL_WEBSAFEKEY_REQUEST, ConferenceForm,
                       path='conference/{websafeKey}',
                       http_method='GET', name='getConference')
     def getConference(self, request):
         """ Return requested conference (by websafeKey)
+
+        The ETag covers the conference and its organizer's profile (for the
+        organizer's display name).
+        """
+        conf_key = ndb.Key(urlsafe=request.websafeKey)
+        etag, not_modified = self._getEtag(
+            request, 'conference:' + request.websafeKey,
+            'profile:' + conf_key.parent().id())
+        if not_modified:
+            return ConferenceForm(etag=etag, notModified=True)
+
+        cf, stale = fallback.serve('conference', request.websafeKey)
+        if not stale:
+            # a stale response must not be cached under the current ETag
+            cf.etag = etag
+        return cf
+
+    @endpoints.method(WebsafeKeysMessage, ConferenceResultForms,
+                      path='conferences/batch',
+                      http_method='POST', name='getConferencesByKeys')
+    def getConferencesByKeys(self, request):
+        """ Return the conferences of a list of websafe keys
+
+        The conferences are read with one batch get (through the entity
+        cache), and their organizers with another. Keys that are invalid
+        or not found are reported per item, in the order requested.
+        """
+        keys = self._parseWebsafeKeys(request.websafeKeys, 'Conference')
+        valid = [key for key in keys if key]
+        found = dict(zip(valid, cache.getMulti(valid)))
+        organizer_keys = list(set(
+            ndb.Key(Profile, conf.organizerUserId)
+            for conf in found.values() if conf))
+        names = {prof.key.id(): prof.displayName
+                 for prof in ndb.get_multi(organizer_keys) if prof}
+
+        items = []
+        for wsk, key in zip(request.websafeKeys, keys):
+            conf = found.get(key) if key else None
+            if not key:
+                items.append(ConferenceResultForm(websafeKey=wsk,
+                                                  error='invalid key'))
+            elif not conf or conf.deleted:
+                items.append(ConferenceResultForm(websafeKey=wsk,
+                                                  error='not found'))
+            else:
+                items.append(ConferenceResultForm(
+                    websafeKey=wsk, conference=self._copyConferenceToForm(
+                        conf, names.get(conf.organizerUserId))))
+        return ConferenceResultForms(items=items)
+
+    def _getConferenceForm(self, wsck):
+        """ Return the ConferenceForm of a conference (by websafeKey)
         """
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeKey).get()
-        if not conf:
+        conf = cache.get(ndb.Key(urlsafe=wsck))
+        if not conf or conf.deleted:
             raise endpoints.NotFoundException(
-                'No conference found with key: {}'.format(
-                    request.websafeKey)
-                )
+                'No conference found with key: {}'.format(wsck))
         prof = conf.key.parent().get()
         # return ConferenceForm
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
@@ -316,19 +761,26 @@ class ConferenceApi(remote.Service):
         return ConferenceForms(
             items=[
                 self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
-                for conf in confs]
+                for conf in confs if not conf.deleted]
         )
 
-    def _getQuery(self, request):
+    def _getQuery(self, request, explain=None):
         """ Return formatted query from the submitted filters
+
+        When an explain dict is given, the normalized filters, the
+        ordering and the index the query requires are added to it.
         """
         q = Conference.query()
+        if not request.includeArchived:
+            q = q.filter(Conference.archived == False)
         inequality_filter, filters = self._formatFilters(request.filters)
 
         # If exists, sort on inequality filter first
         if not inequality_filter:
+            ordering = ['name']
             q = q.order(Conference.name)
         else:
+            ordering = [inequality_filter, 'name']
             q = q.order(ndb.GenericProperty(inequality_filter))
             q = q.order(Conference.name)
 
@@ -340,6 +792,25 @@ class ConferenceApi(remote.Service):
                 filtr["operator"],
                 filtr["value"])
             q = q.filter(formatted_query)
+
+        if explain is not None:
+            if not request.includeArchived:
+                filters = [{'field': 'archived', 'operator': '=',
+                            'value': False}] + filters
+            # equality filters come first in an index, then the orders
+            properties = []
+            for prop in ([f['field'] for f in filters
+                          if f['operator'] == '='] + ordering):
+                if prop not in properties:
+                    properties.append(prop)
+            explain['filters'] = filters
+            explain['ordering'] = ordering
+            explain['requiredIndex'] = (
+                'Conference({})'.format(', '.join(properties))
+                if len(properties) > 1 else 'built-in')
+            # ndb runs != as a < and a > query, merged on the ordering
+            explain['subqueries'] = 2 if any(
+                f['operator'] == '!=' for f in filters) else 1
         return q
 
     def _formatFilters(self, filters):
@@ -399,22 +870,54 @@ class ConferenceApi(remote.Service):
     def queryConferences(self, request):
         """ Query for conferences.
         """
-        conferences = self._getQuery(request)
-
-        names = self._getConferenceOrganisers(conferences)
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(
-                conf, names[conf.organizerUserId]) for conf in conferences]
-        )
+        self._checkRateLimit('queryConferences')
+        explain = {} if request.explain else None
+        rpcs = {}
+        timings = OrderedDict()
+
+        start = time.time()
+        with countRpcs() as rpcs['query']:
+            fetched = self._getQuery(request, explain).fetch()
+        # deleted conferences are archived, but may still be listed with
+        # includeArchived until they are removed
+        conferences = [conf for conf in fetched if not conf.deleted]
+        timings['query'] = time.time() - start
+
+        start = time.time()
+        with countRpcs() as rpcs['organizers']:
+            names = self._getConferenceOrganisers(conferences)
+        timings['organizers'] = time.time() - start
+
+        start = time.time()
+        with countRpcs() as rpcs['serialization']:
+            # return individual ConferenceForm object per Conference
+            cf = ConferenceForms(
+                items=[self._copyConferenceToForm(
+                    conf, names[conf.organizerUserId])
+                    for conf in conferences]
+            )
+        timings['serialization'] = time.time() - start
+
+        if explain is not None:
+            explain['entitiesReturned'] = len(fetched)
+            explain['listed'] = len(conferences)
+            explain['rpcs'] = rpcs
+            explain['ms'] = OrderedDict(
+                (stage, round(seconds * 1000.0, 3))
+                for stage, seconds in timings.items())
+            cf.explain = json.dumps(explain)
+        return cf
 
     # TASK 3
     def _intersectQueries(self, q1, q2):
-        """ Return objects according to an intersection of two queries
+        """ Return conferences according to an intersection of two queries
+
+        Conferences that are deleted (but not cleaned up yet) are left out.
         """
-        return ndb.get_multi(
+        confs = ndb.get_multi(
             set(q1.fetch(keys_only=True))
             & set(q2.fetch(keys_only=True)))
+        return [conf for conf in confs if conf and not conf.deleted]
 
     # TASK 3
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -428,8 +931,10 @@ class ConferenceApi(remote.Service):
         date_until = (date_today + timedelta(3*365/12))
 
         confs_from = Conference.query(
+            Conference.archived == False,
             Conference.endDate >= date_today)
         confs_till = Conference.query(
+            Conference.archived == False,
             Conference.startDate <= date_until
         )
 
@@ -447,17 +952,18 @@ class ConferenceApi(remote.Service):
     def getNonWorkshopsBeforeSevenPM(self, request):
         """ Only show non-workshop sessions before 7PM
         """
-        non_workshop = Session.query(
-            Session.typeOfSession != 'WORKSHOP')
-        before_seven = Session.query(
-            # XXX replace startTime with endTime (which has to be
-            # calculated first
-            Session.startTime < datetime.strptime("19:00", "%H:%M").time())
-
-        sessions = self._intersectQueries(non_workshop, before_seven)
+        # the planner queries startTime, and checks the type in memory
+        sessions = self._querySessions([
+            {'field': 'typeOfSession', 'operator': '!=',
+             'value': 'WORKSHOP'},
+            # XXX replace startTime with endTime (stored since the
+            # session_end_times migration)?
+            {'field': 'startTime', 'operator': '<',
+             'value': datetime.strptime("19:00", "%H:%M").time()},
+        ], includeArchived=True)
 
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessions])
+            items=self._copySessionsToForms(sessions))
 
     # TASK 3
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -468,8 +974,10 @@ class ConferenceApi(remote.Service):
         """ Only show conferences in Amsterdam that are not sold out
         """
         in_amsterdam = Conference.query(
+            Conference.archived == False,
             Conference.city == 'Amsterdam')
         not_sold_out = Conference.query(
+            Conference.archived == False,
             Conference.seatsAvailable > 0)
 
         confs = self._intersectQueries(in_amsterdam, not_sold_out)
@@ -479,21 +987,113 @@ class ConferenceApi(remote.Service):
             items=[self._copyConferenceToForm(
                 conf, names[conf.organizerUserId]) for conf in confs])
 
+    @staticmethod
+    def _getAggregateValues(conf):
+        """ Return the (dimension, value) pairs a conference counts towards
+
+        A conference is counted for its city, each of its topics and its
+        month (zero-padded, so months sort in order).
+        """
+        values = [('city', conf.city)] if conf.city else []
+        values.extend(('topic', topic) for topic in set(conf.topics))
+        if conf.month:
+            values.append(('month', '%02d' % conf.month))
+        return values
+
+    @staticmethod
+    def _getAggregateDeltas(conf, conferences, seats, deltas=None):
+        """ Add changes to the aggregates a conference counts towards
+
+        The changes to the conference count and the available seats of
+        each value are added to deltas, a dict of counter names, which is
+        created when not given. Conferences that aren't counted yet (see
+        the conference_aggregates migration) add nothing.
+        """
+        deltas = defaultdict(int) if deltas is None else deltas
+        if not conf.aggregated:
+            return deltas
+        for dimension, value in ConferenceApi._getAggregateValues(conf):
+            deltas[AGGREGATE_COUNTER % ('conferences', dimension,
+                                        value)] += conferences
+            deltas[AGGREGATE_COUNTER % ('seats', dimension, value)] += seats
+        return deltas
+
+    @staticmethod
+    def _queueAggregates(deltas, conf=None):
+        """ Have changes to counters applied by a task
+
+        Call this in the transaction that makes the changes, so the task
+        is added if (and only if) it commits. The values of a created or
+        updated conference are added to their dimensions as well, so the
+        stats endpoint can list them.
+        """
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        memberships = (
+            [(AGGREGATE_GROUP % dimension, value) for dimension, value in
+             ConferenceApi._getAggregateValues(conf)] if conf else [])
+        if deltas or memberships:
+            taskqueue.add(params={'deltas': json.dumps(deltas),
+                                  'memberships': json.dumps(memberships)},
+                          url='/tasks/apply_counters', transactional=True)
+
+    @staticmethod
+    def _applyAggregates(deltas, memberships, task_name):
+        """ Apply changes to counters queued by _queueAggregates()
+
+        The deltas are applied at most once per task, however often it's
+        retried; adding members to groups can simply be repeated.
+        """
+        counters.addToGroups([tuple(membership) for membership in
+                              json.loads(memberships)])
+        counters.incrementCounters(json.loads(deltas), batch_id=task_name)
+
+    @endpoints.method(STATS_GET_REQUEST, ConferenceStatForms,
+                      path='conferences/stats/{dimension}',
+                      http_method='GET', name='getConferenceStats')
+    def getConferenceStats(self, request):
+        """ Return conference counts and available seats per city, topic or
+        month
+
+        The stats are read from sharded counters, which are kept up to date
+        as conferences are created, updated and registered for.
+        """
+        if request.dimension not in AGGREGATE_DIMENSIONS:
+            raise endpoints.BadRequestException(
+                'Dimension must be one of: %s' % ', '.join(
+                    AGGREGATE_DIMENSIONS))
+        group = AGGREGATE_GROUP % request.dimension
+        values = sorted(counters.getGroups([group])[group])
+        totals = counters.getCounts(
+            [AGGREGATE_COUNTER % (measure, request.dimension, value)
+             for value in values for measure in ('conferences', 'seats')])
+        return ConferenceStatForms(items=[
+            ConferenceStatForm(
+                value=value,
+                conferences=totals[AGGREGATE_COUNTER % (
+                    'conferences', request.dimension, value)],
+                seatsAvailable=totals[AGGREGATE_COUNTER % (
+                    'seats', request.dimension, value)])
+            for value in values])
+
     # TASK 4
-    def _getSpeakerSchedule(self, speaker, conf):
-        """ Return a speaker's schedule
+    @staticmethod
+    def _scheduleFeaturedSpeakers(conf_wsk):
+        """ Have the featured speakers of a conference recomputed
 
-        This will return a schedule with sessions a speaker is scheduled for at
-        the given conference, so it can be used to determine wether the speaker
-        is (still) a featured speaker or not.
+        A burst of changes to the sessions of one conference results in a
+        single recomputation per FEATURED_SPEAKERS_WINDOW.
+        """
+        return ConferenceApi._enqueueCoalesced(
+            '/tasks/set_featured_speakers', conf_wsk, FEATURED_SPEAKERS_WINDOW)
 
-        The schedule is a dict with the speaker's websafe key as its only key.
-        The value for this key is a dictionary with keys for 'name' and
-        'sessions', where the value for 'name' is the speaker's name, and the
-        value for 'sessions' has a dictionary with sessions' websafe keys and
-        titles as its items.
+    # TASK 4
+    @staticmethod
+    def _updateFeaturedSpeakers(conf_wsk):
+        """ Recompute the featured speakers of a conference
 
-        So, a schedule will look like this:
+        A speaker who speaks at more than one session of the conference is a
+        featured speaker. The featured speakers are stored in memcache as a
+        dict with a schedule per speaker's websafe key, like:
 
             featured[<speaker_wsk>] = {
                 'name': '<name>',
@@ -503,103 +1103,112 @@ class ConferenceApi(remote.Service):
                 }
             }
         """
-        all_sess_by_spkr = Session.query(Session.speakers == speaker)
-        all_sess_of_conf = Session.query(ancestor=conf)
-        sessions = self._intersectQueries(all_sess_by_spkr, all_sess_of_conf)
+        conf_key = ndb.Key(urlsafe=conf_wsk)
 
-        speaker_schedule = {
-            speaker.urlsafe(): {
-                'name': speaker.get().name,
-                'sessions': {
-                    session.key.urlsafe(): session.name for session in sessions
+        # one ancestor query for all sessions, grouped by speaker
+        schedules = defaultdict(dict)
+        for session in Session.query(ancestor=conf_key):
+            for spkr_key in session.speakers:
+                schedules[spkr_key][session.key.urlsafe()] = session.name
+
+        spkr_keys = [spkr_key for spkr_key, sessions in schedules.items()
+                     if len(sessions) > 1]
+        featured = {}
+        for spkr_key, speaker in zip(spkr_keys, cache.getMulti(spkr_keys)):
+            if speaker:
+                featured[spkr_key.urlsafe()] = {
+                    'name': speaker.name,
+                    'sessions': schedules[spkr_key],
                 }
-            }
-        }
-        log_values({
-            'SCHEDULE': speaker_schedule,
-            'len(sessions)': len(sessions)
-            })
-        return speaker_schedule
-
-    # TASK 4
-    @staticmethod
-    def _updateFeaturedSpeakers(conf, json_schedule):
-        """ Update list of featured speakers
-
-        This will update the list of featured speakers, based on a given
-        conference and a new schedule of a certain speaker.
-        """
-        speaker_schedule = json.loads(json_schedule)
-        conf_key = ndb.Key(urlsafe=conf)
-        cached = memcache.get(MEMCACHE_FEATURED_KEY_PREFIX+conf_key.urlsafe())
-        if cached:
-            featured = json.loads(cached)
-        else:
-            featured = dict()
-
-        speaker_wsk = speaker_schedule.keys()[0]
-
-        # If the speaker's schedule has more than 1 session in it, we
-        # have to make sure the speaker (and its schedule) are part of
-        # the list of featured speakers of the given conference.
-        if len(speaker_schedule[speaker_wsk]['sessions']) > 1:
-            featured[speaker_wsk] = speaker_schedule[speaker_wsk]
-        # Else we have to make sure the speaker (and its schedule) are
-        # not part of the list of featured speakers of the given
-        # conference.
-        else:
-            if speaker_wsk in featured:
-                if speaker_wsk in featured:
-                    del featured[speaker_wsk]
 
+        # no featured speakers are stored too ("{}"), so the warmup can
+        # tell them from featured speakers that were never computed
         memcache_key = MEMCACHE_FEATURED_KEY_PREFIX+conf_key.urlsafe()
-        if featured:
-            memcache.set(memcache_key,
-                         value=json.dumps(featured),
-                         time=86400)
-        else:
-            memcache.delete(memcache_key)
+        cached = memcache.get(memcache_key)
+        memcache.set(memcache_key,
+                     value=json.dumps(featured),
+                     time=86400)
+        if (cached or "{}") != json.dumps(featured):
+            ConferenceApi._bumpVersions('featured:' + conf_wsk)
+
+        log_values(ConferenceApi._getCounters(
+            ['set_featured_speakers_enqueued',
+             'set_featured_speakers_suppressed']))
 
     # TASK 4
-    @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, StringMessage,
+    @endpoints.method(CONDITIONAL_WEBSAFEKEY_REQUEST, StringMessage,
                       path='speakers/featured',
                       http_method='POST', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
         """ Return featured speakers from memcache as a JSON string
         """
+        etag, not_modified = self._getEtag(
+            request, 'featured:' + request.websafeKey)
+        if not_modified:
+            return StringMessage(data='', etag=etag, notModified=True)
+
         memcache_key = MEMCACHE_FEATURED_KEY_PREFIX+request.websafeKey
-        cache = memcache.get(memcache_key)
-        featured = cache or "{}"
-        return StringMessage(data=featured)
+        featured = memcache.get(memcache_key) or "{}"
+        return StringMessage(data=featured, etag=etag)
 
 # - - - Session objects - - - - - - - - - - - - - - - - - - -
 
-    def _copySessionToForm(self, session):
+    def _copySessionToForm(self, session, speakers=None):
         """ Copy relevant fields from Session to SessionForm
+
+        The speakers of the session are embedded, from speakers (a dict of
+        Speakers by key) or, when that isn't given, looked up.
         """
+        if speakers is None:
+            speakers = self._getSessionSpeakers([session])
         sf = SessionForm()
         for field in sf.all_fields():
             if hasattr(session, field.name):
-                # XXX Save an endTime when startTime and duration is
-                # both given
-                if field.name in ('date', 'startTime'):
+                if field.name in ('date', 'startTime', 'endTime'):
                     # convert Date and Time to date and time string
-                    setattr(sf, field.name, str(getattr(session, field.name)))
+                    value = getattr(session, field.name)
+                    setattr(sf, field.name, value and str(value))
                 elif field.name == 'typeOfSession':
                     # convert typeOfSession string to Enum
                     setattr(sf, field.name, getattr(SessionType,
                             getattr(session, field.name)))
                 elif field.name == 'speakers':
-                    setattr(sf, field.name, [str(speaker)
-                            for speaker in getattr(session, field.name)])
+                    setattr(sf, field.name, [spkr_key.urlsafe()
+                            for spkr_key in getattr(session, field.name)])
                 else:
                     # just copy the others
                     setattr(sf, field.name, getattr(session, field.name))
             elif field.name == "websafeKey":
                 setattr(sf, field.name, session.key.urlsafe())
+            elif field.name == "speakerSummaries":
+                setattr(sf, field.name, [
+                    SpeakerMiniForm(name=speakers[spkr_key].name,
+                                    twitter=speakers[spkr_key].twitter,
+                                    websafeKey=spkr_key.urlsafe())
+                    for spkr_key in session.speakers
+                    if speakers.get(spkr_key)])
         sf.check_initialized()
         return sf
 
+    @staticmethod
+    def _getSessionSpeakers(sessions):
+        """ Return a dict with the Speakers of sessions by key
+
+        The speakers of all sessions are looked up at once, deduplicated,
+        through the entity cache.
+        """
+        spkr_keys = list(set(spkr_key for session in sessions
+                             for spkr_key in session.speakers))
+        return dict(zip(spkr_keys, cache.getMulti(spkr_keys)))
+
+    def _copySessionsToForms(self, sessions):
+        """ Copy Sessions to SessionForms, with one lookup of speakers
+        """
+        sessions = list(sessions)
+        speakers = self._getSessionSpeakers(sessions)
+        return [self._copySessionToForm(session, speakers)
+                for session in sessions]
+
     def _createSessionObject(self, request):
         """ Create or update Session object, returning SessionForm/request
         """
@@ -610,7 +1219,7 @@ class ConferenceApi(remote.Service):
         conf_wsk = request.websafeConferenceKey
         conf_key = ndb.Key(urlsafe=conf_wsk)
         conf = conf_key.get()
-        if not conf:
+        if not conf or conf.deleted:
             raise endpoints.NotFoundException(
                 'No conference found with key {}'.format(
                     request.websafeConferenceKey)
@@ -643,10 +1252,15 @@ class ConferenceApi(remote.Service):
         if data['date']:
             data['date'] = datetime.strptime(data['date'], "%Y-%m-%d").date()
 
-        # convert startTime from string to Time
+        # convert startTime from string to Time, and store the endTime
+        # that follows from it
+        del data['endTime']
         if data['startTime']:
             data['startTime'] = datetime.strptime(data['startTime'][:5],
                                                   "%H:%M").time()
+            data['endTime'] = (
+                datetime.combine(datetime.min, data['startTime'])
+                + timedelta(minutes=data['duration'])).time()
 
         data['typeOfSession'] = str(data['typeOfSession'])
         if data['speakers']:
@@ -655,11 +1269,9 @@ class ConferenceApi(remote.Service):
 
             # Update session if there already is a websafeKey
             if data['websafeKey']:
-                for speaker in spkr_keys:
-                    self._updateSpeakerForSession(
-                        websafeSpeakerKey=speaker.urlsafe(),
-                        websafeSessionKey=data['websafeKey'],
-                        add=True)
+                self._updateSpeakersForSessions(
+                    [(data['websafeKey'], speaker, True)
+                     for speaker in data['speakers']])
             data['speakers'] = spkr_keys
 
         # generate Conference Key based on websafeConferenceKey and
@@ -671,30 +1283,31 @@ class ConferenceApi(remote.Service):
 
         del data['websafeKey']
         del data['websafeConferenceKey']
+        del data['speakerSummaries']
 
         # create Session, send email to organizer confirming creation of
         # Session and return (modified) SessionForm
         session = Session(**data).put()
 
-        # Check if there is more than one session by speakers of this
-        # session. Speakers that are speaking at more than one session
-        # of the same conference are featured speakers, and should be
-        # added to a Memcache entry for featured speakers. (TASK 4)
+        # Speakers that are speaking at more than one session of the same
+        # conference are featured speakers, and should be added to a
+        # Memcache entry for featured speakers. (TASK 4)
         if data['speakers']:
-            for speaker in data['speakers']:
-                schedule = self._getSpeakerSchedule(speaker, conf_key)
-                taskqueue.add(params={'conf_wsk': conf_wsk,
-                                      'schedule': schedule},
-                              url='/tasks/set_featured_speakers')
-
-        taskqueue.add(params={'email': user.email(),
-                              'sessionInfo': repr(request)},
-                      url='/tasks/send_confirmation_email')
+            self._scheduleFeaturedSpeakers(conf_wsk)
+        self._scheduleTimetable(conf_wsk)
+        self._bumpVersions('sessions:' + conf_wsk)
+
+        self._queueConfirmationEmail(
+            user.email(), u'Session: {} at {} ({} {})'.format(
+                request.name, conf.name, request.date or '?',
+                request.startTime or '?'))
         return self._copySessionToForm(session.get())
 
-    def _updateSpeakerForSession(self, websafeSpeakerKey, websafeSessionKey,
-                                 add):
-        """ Based on the calling endpoint, add or remove a Speaker
+    @ndb.transactional()
+    def _applySpeakerEdits(self, websafeSessionKey, edits):
+        """ Apply (speaker key, add) edits to a Session in one write
+
+        Returns the session, and whether any of the edits changed it.
         """
         session = ndb.Key(urlsafe=websafeSessionKey).get()
         if not session:
@@ -704,42 +1317,78 @@ class ConferenceApi(remote.Service):
                 )
             )
 
-        spkr_key = ndb.Key(urlsafe=websafeSpeakerKey)
-        if not spkr_key:
-            raise endpoints.NotFoundException(
-                'No speaker found with key: {}'.format(
-                    websafeSpeakerKey
-                )
-            )
-
-        conf_key = session.key.parent()
-        conf_wsk = conf_key.urlsafe()
-        if add:
-            if spkr_key not in session.speakers:
+        changed = False
+        for spkr_key, add in edits:
+            if add and spkr_key not in session.speakers:
                 session.speakers.append(spkr_key)
-                session.put()
-
-                speaker_schedule = self._getSpeakerSchedule(spkr_key, conf_key)
-                if len(speaker_schedule[websafeSpeakerKey]['sessions']) > 1:
-                    taskqueue.add(
-                        params={
-                            'conf_wsk': conf_wsk,
-                            'schedule': json.dumps(speaker_schedule)},
-                        url='/tasks/set_featured_speakers')
-        else:
-            if spkr_key in session.speakers:
+                changed = True
+            elif not add and spkr_key in session.speakers:
                 session.speakers.remove(spkr_key)
-                session.put()
+                changed = True
+        if changed:
+            session.put()
+        return session, changed
+
+    def _updateSpeakersForSessions(self, edits):
+        """ Add or remove Speakers of Sessions, given (websafeSessionKey,
+        websafeSpeakerKey, add) edits
+
+        Edits are grouped per session, and every session is written once in
+        its own transaction. The featured speakers and timetable are
+        recomputed once per affected conference, for all speakers at once.
+        Returns the sessions in the order they first appear in the edits.
+        """
+        by_session = OrderedDict()
+        for websafeSessionKey, websafeSpeakerKey, add in edits:
+            by_session.setdefault(websafeSessionKey, []).append(
+                (ndb.Key(urlsafe=websafeSpeakerKey), add))
+
+        # make sure all speakers and sessions exist before writing any
+        # session, with a single get_multi each
+        spkr_keys = list(set(spkr_key for sess_edits in by_session.values()
+                             for spkr_key, _ in sess_edits))
+        for spkr_key, speaker in zip(spkr_keys, ndb.get_multi(spkr_keys)):
+            if not speaker:
+                raise endpoints.NotFoundException(
+                    'No speaker found with key: {}'.format(
+                        spkr_key.urlsafe()
+                    )
+                )
+        sess_keys = [ndb.Key(urlsafe=websafeSessionKey)
+                     for websafeSessionKey in by_session]
+        for websafeSessionKey, session in zip(by_session,
+                                              ndb.get_multi(sess_keys)):
+            if not session:
+                raise endpoints.NotFoundException(
+                    'No session found with key: {}'.format(
+                        websafeSessionKey
+                    )
+                )
 
-                speaker_schedule = self._getSpeakerSchedule(spkr_key, conf_key)
-                if len(speaker_schedule[websafeSpeakerKey]['sessions']) < 2:
-                    taskqueue.add(
-                        params={
-                            'conf_wsk': conf_wsk,
-                            'schedule': json.dumps(speaker_schedule)},
-                        url='/tasks/set_featured_speakers')
+        sessions = []
+        changed_confs = set()
+        try:
+            for websafeSessionKey, sess_edits in by_session.items():
+                session, changed = self._applySpeakerEdits(websafeSessionKey,
+                                                           sess_edits)
+                sessions.append(session)
+                if changed:
+                    changed_confs.add(session.key.parent().urlsafe())
+        finally:
+            # also for the sessions written before a later one failed
+            for conf_wsk in changed_confs:
+                self._scheduleFeaturedSpeakers(conf_wsk)
+                self._scheduleTimetable(conf_wsk)
+                self._bumpVersions('sessions:' + conf_wsk)
+        return sessions
 
-        return self._copySessionToForm(session)
+    def _updateSpeakerForSession(self, websafeSpeakerKey, websafeSessionKey,
+                                 add):
+        """ Based on the calling endpoint, add or remove a Speaker
+        """
+        sessions = self._updateSpeakersForSessions(
+            [(websafeSessionKey, websafeSpeakerKey, add)])
+        return self._copySessionToForm(sessions[0])
 
     @endpoints.method(SESSION_POST_REQUEST_MODIFY_SPEAKERS, SessionForm,
                       http_method='PUT', name='addSpeakerToSession')
@@ -763,6 +1412,17 @@ class ConferenceApi(remote.Service):
                                              websafeSessionKey=session,
                                              add=False)
 
+    @endpoints.method(SpeakerEditForms, SessionForms,
+                      path='sessions/speakers', http_method='PUT',
+                      name='updateSessionSpeakers')
+    def updateSessionSpeakers(self, request):
+        """ Add and remove Speakers of multiple Sessions at once
+        """
+        sessions = self._updateSpeakersForSessions(
+            [(edit.websafeSessionKey, edit.websafeSpeakerKey, edit.add)
+             for edit in request.edits])
+        return SessionForms(items=self._copySessionsToForms(sessions))
+
     def _getSessions(self, wsck, typeFilter=None, speakerFilter=None):
         conf_key = ndb.Key(urlsafe=wsck)
 
@@ -778,17 +1438,53 @@ class ConferenceApi(remote.Service):
         if speakerFilter:
             sessions = sessions.filter(Session.speakers == speakerFilter)
 
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return SessionForms(items=self._copySessionsToForms(sessions))
 
-    @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, SessionForms,
+    @endpoints.method(CONDITIONAL_WEBSAFEKEY_REQUEST, SessionForms,
                       path='conference/{websafeKey}/sessions',
                       http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """ Given a conference with a websafeKey, return all sessions
         """
-        return self._getSessions(request.websafeKey)
+        self._checkRateLimit('getConferenceSessions')
+        etag, not_modified = self._getEtag(
+            request, 'sessions:' + request.websafeKey)
+        if not_modified:
+            return SessionForms(etag=etag, notModified=True)
+
+        sf, stale = fallback.serve('sessions', request.websafeKey)
+        if not stale:
+            sf.etag = etag
+        return sf
+
+    @endpoints.method(WebsafeKeysMessage, SessionResultForms,
+                      path='sessions/batch',
+                      http_method='POST', name='getSessionsByKeys')
+    def getSessionsByKeys(self, request):
+        """ Return the sessions of a list of websafe keys
+
+        The sessions are read with one batch get, and their speakers with
+        one lookup. Keys that are invalid or not found are reported per
+        item, in the order requested.
+        """
+        keys = self._parseWebsafeKeys(request.websafeKeys, 'Session')
+        valid = [key for key in keys if key]
+        sessions = [session for session in ndb.get_multi(valid) if session]
+        forms = dict(zip([session.key for session in sessions],
+                         self._copySessionsToForms(sessions)))
+
+        items = []
+        for wsk, key in zip(request.websafeKeys, keys):
+            if not key:
+                items.append(SessionResultForm(websafeKey=wsk,
+                                               error='invalid key'))
+            elif key not in forms:
+                items.append(SessionResultForm(websafeKey=wsk,
+                                               error='not found'))
+            else:
+                items.append(SessionResultForm(websafeKey=wsk,
+                                               session=forms[key]))
+        return SessionResultForms(items=items)
 
     @endpoints.method(SESSION_GET_REQUEST_FILTERED, SessionForms,
                       path='sessions/type/{typeOfSession}',
@@ -810,14 +1506,244 @@ class ConferenceApi(remote.Service):
     def getSessionsBySpeaker(self, request):
         """ Get all sessions by a particular speaker given
 
-        This returns sessions accross all conferences.
+        This returns sessions accross all conferences, leaving out those of
+        archived conferences unless includeArchived is set.
         """
         spkr_key = ndb.Key(urlsafe=request.speaker)
         sessions = Session.query(Session.speakers == spkr_key)
+        if not request.includeArchived:
+            sessions = sessions.filter(Session.archived == False)
+
+        return SessionForms(
+            items=self._copySessionsToForms(sessions))
+
+    def _formatSessionFilters(self, filters):
+        """ Parse, check validity and format user supplied session filters
+        """
+        formatted_filters = []
+        for f in filters:
+            try:
+                field = SESSION_FIELDS[f.field]
+                op = OPERATORS[f.operator]
+            except KeyError:
+                raise endpoints.BadRequestException(
+                    "Filter contains invalid field or operator.")
+            if field == 'conference' and op != '=':
+                raise endpoints.BadRequestException(
+                    "Only EQ is allowed on CONFERENCE.")
+            if field == 'speakers' and op not in ('=', '!='):
+                raise endpoints.BadRequestException(
+                    "Only EQ and NE are allowed on SPEAKER.")
+
+            try:
+                if field in ('conference', 'speakers'):
+                    value = ndb.Key(urlsafe=f.value)
+                elif field == 'date':
+                    value = datetime.strptime(f.value, "%Y-%m-%d").date()
+                elif field in ('startTime', 'endTime'):
+                    value = datetime.strptime(f.value[:5], "%H:%M").time()
+                elif field == 'duration':
+                    value = int(f.value)
+                else:
+                    value = f.value
+            except (TypeError, ValueError, ProtocolBufferDecodeError):
+                raise endpoints.BadRequestException(
+                    "Invalid value for {}: {}".format(f.field, f.value))
+            formatted_filters.append(
+                {'field': field, 'operator': op, 'value': value})
+        return formatted_filters
 
+    @staticmethod
+    def _planSessionQuery(filters, includeArchived=False):
+        """ Return a datastore query and the filters left to apply in memory
+
+        Only one filter goes to the datastore (so no composite index is
+        needed): the one that is expected to be the most selective. For an
+        inequality, all bounds on its field go along. Inequality filters
+        (!=) are never sent, as the datastore would run two queries for
+        them.
+        """
+        indexable = [f for f in filters if f['operator'] != '!=']
+        if not indexable:
+            if includeArchived:
+                return Session.query(), filters
+            return Session.query(Session.archived == False), filters
+
+        best = min(indexable, key=lambda f: SESSION_FILTER_RANKS.get(
+            (f['field'], f['operator'] == '='), len(SESSION_FILTER_RANKS)))
+        if best['field'] == 'conference':
+            query = Session.query(ancestor=best['value'])
+            pushed = [best]
+        else:
+            if best['operator'] == '=':
+                pushed = [best]
+            else:
+                pushed = [f for f in indexable if f['field'] == best['field']
+                          and f['operator'] != '=']
+            query = Session.query()
+            for f in pushed:
+                # comparing the property converts the value for the query
+                query = query.filter(COMPARATORS[f['operator']](
+                    getattr(Session, f['field']), f['value']))
+        return query, [f for f in filters if f not in pushed]
+
+    @staticmethod
+    def _matchesSession(session, filters, includeArchived=False):
+        """ Return whether a session passes the filters (in memory)
+
+        Like in the datastore, a session without a value for a field never
+        passes a filter on that field.
+        """
+        if session.archived and not includeArchived:
+            return False
+        for f in filters:
+            if f['field'] == 'conference':
+                actual = session.key.parent()
+            elif f['field'] == 'speakers':
+                if (f['value'] in session.speakers) != (f['operator'] == '='):
+                    return False
+                continue
+            else:
+                actual = getattr(session, f['field'])
+            if actual is None or not COMPARATORS[f['operator']](
+                    actual, f['value']):
+                return False
+        return True
+
+    def _querySessions(self, filters, includeArchived=False, limit=None):
+        """ Return the sessions that pass the filters, up to limit
+
+        The query is streamed, and stops as soon as limit sessions passed.
+        """
+        query, in_memory = self._planSessionQuery(filters, includeArchived)
+        sessions = []
+        scanned = 0
+        for session in query.iter(batch_size=SESSION_QUERY_LIMIT):
+            scanned += 1
+            if self._matchesSession(session, in_memory, includeArchived):
+                sessions.append(session)
+                if limit and len(sessions) >= limit:
+                    break
+        logging.debug('Session query: %d scanned, %d returned, %d '
+                      'filter(s) in memory', scanned, len(sessions),
+                      len(in_memory))
+        return sessions
+
+    @endpoints.method(SessionQueryForms, SessionForms,
+                      path='sessions/query', http_method='POST',
+                      name='querySessions')
+    def querySessions(self, request):
+        """ Query for sessions across conferences
+
+        Filters are like those of queryConferences, on the fields
+        CONFERENCE (EQ only), SPEAKER (EQ and NE), TYPE, DATE (YYYY-MM-DD),
+        START_TIME, END_TIME (HH:MM) and DURATION (minutes); any number of
+        inequalities may be combined. At most limit sessions are returned.
+        """
+        if request.limit is not None and request.limit < 0:
+            raise endpoints.BadRequestException(
+                "Invalid limit: {}".format(request.limit))
+        limit = min(request.limit or SESSION_QUERY_LIMIT,
+                    SESSION_QUERY_MAX_LIMIT)
+        sessions = self._querySessions(
+            self._formatSessionFilters(request.filters),
+            includeArchived=bool(request.includeArchived), limit=limit)
         return SessionForms(
-            items=[self._copySessionToForm(session)
-                   for session in sessions])
+            items=self._copySessionsToForms(sessions))
+
+    @staticmethod
+    def _scheduleTimetable(conf_wsk):
+        """ Have the timetable of a conference rebuilt
+
+        Like the featured speakers, a burst of changes results in a single
+        rebuild per TIMETABLE_WINDOW.
+        """
+        return ConferenceApi._enqueueCoalesced(
+            '/tasks/build_timetable', conf_wsk, TIMETABLE_WINDOW)
+
+    @staticmethod
+    def _buildTimetable(conf_wsk):
+        """ Build and store the timetable of a conference
+
+        The timetable is a JSON document with the sessions of a conference
+        grouped by date and startTime, and with the names of their speakers
+        resolved:
+
+            {
+                'days': [{
+                    'date': '<date>',
+                    'slots': [{
+                        'startTime': '<startTime>',
+                        'sessions': [{
+                            'websafeKey': <session_wsk>,
+                            'name': <session_title>,
+                            ...
+                            'speakers': [{'websafeKey': <speaker_wsk>,
+                                          'name': <speaker_name>}]
+                        }]
+                    }]
+                }]
+            }
+
+        It is stored as a single Timetable entity and in memcache, so
+        reading it costs a single get.
+        """
+        conf_key = ndb.Key(urlsafe=conf_wsk)
+        sessions = Session.query(ancestor=conf_key).fetch()
+
+        spkr_keys = list(set(spkr_key for session in sessions
+                             for spkr_key in session.speakers))
+        names = {spkr_key: speaker.name for spkr_key, speaker in
+                 zip(spkr_keys, cache.getMulti(spkr_keys)) if speaker}
+
+        days = defaultdict(lambda: defaultdict(list))
+        for session in sessions:
+            days[session.date][session.startTime].append({
+                'websafeKey': session.key.urlsafe(),
+                'name': session.name,
+                'typeOfSession': session.typeOfSession,
+                'duration': session.duration,
+                'endTime': session.endTime and str(session.endTime),
+                'speakers': [{'websafeKey': spkr_key.urlsafe(),
+                              'name': names.get(spkr_key)}
+                             for spkr_key in session.speakers],
+            })
+
+        timetable = json.dumps({'days': [{
+            'date': day and str(day),
+            'slots': [{
+                'startTime': slot and str(slot),
+                'sessions': sorted(days[day][slot],
+                                   key=lambda sess: sess['name']),
+            } for slot in sorted(days[day], key=lambda t: (t is None, t))],
+        } for day in sorted(days, key=lambda d: (d is None, d))]})
+
+        Timetable(id=conf_wsk, data=timetable).put()
+        memcache.set(MEMCACHE_TIMETABLE_KEY_PREFIX+conf_wsk, timetable)
+        return timetable
+
+    @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, StringMessage,
+                      path='conference/{websafeKey}/timetable',
+                      http_method='GET', name='getConferenceTimetable')
+    def getConferenceTimetable(self, request):
+        """ Return the sessions of a conference grouped by date and time
+
+        The timetable is returned as a JSON string, see _buildTimetable().
+        """
+        wsck = request.websafeKey
+        timetable = memcache.get(MEMCACHE_TIMETABLE_KEY_PREFIX+wsck)
+        if timetable is None:
+            stored = ndb.Key(Timetable, wsck).get()
+            if stored:
+                timetable = stored.data
+                memcache.set(MEMCACHE_TIMETABLE_KEY_PREFIX+wsck, timetable)
+            else:
+                # not built yet since the conference has sessions
+                if not ndb.Key(urlsafe=wsck).get():
+                    raise endpoints.NotFoundException(
+                        'No conference found with key: {}'.format(wsck))
+                timetable = self._buildTimetable(wsck)
+        return StringMessage(data=timetable)
 
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
                       path='conference/{websafeConferenceKey}/session',
@@ -860,15 +1786,49 @@ class ConferenceApi(remote.Service):
         data['key'] = s_key
 
         spkr_key = Speaker(**data).put()
+        # rebuild the index with the new speaker in it, rather than leave it
+        # to the next reader, whose query may not see the speaker yet
+        cache.invalidate(CACHE_SPEAKER_INDEX)
+        cache.getValue(CACHE_SPEAKER_INDEX,
+                       lambda: self._loadSpeakerIndex(spkr_key))
         return self._copySpeakerToForm(spkr_key.get())
 
+    @staticmethod
+    def _loadSpeakerIndex(new_key=None):
+        """ Return the websafe keys of all speakers (and of new_key)
+
+        Returns None when there are more than SPEAKER_INDEX_MAX_KEYS.
+        """
+        spkr_keys = Speaker.query().fetch(SPEAKER_INDEX_MAX_KEYS + 1,
+                                          keys_only=True)
+        if new_key and new_key not in spkr_keys:
+            spkr_keys.append(new_key)
+        if len(spkr_keys) > SPEAKER_INDEX_MAX_KEYS:
+            return None
+        return [spkr_key.urlsafe() for spkr_key in spkr_keys]
+
+    @staticmethod
+    def _getSpeakerIndex():
+        """ Return all speakers, through the two-tier cache
+
+        The cache holds the keys of all speakers, and the speakers by key.
+        Speakers are only added (by createSpeaker), which rebuilds the keys.
+        Beyond SPEAKER_INDEX_MAX_KEYS speakers, they are queried instead.
+        """
+        wsks = cache.getValue(CACHE_SPEAKER_INDEX,
+                              ConferenceApi._loadSpeakerIndex)
+        if wsks is None:
+            return Speaker.query().fetch()
+        speakers = cache.getMulti([ndb.Key(urlsafe=wsk) for wsk in wsks])
+        return [speaker for speaker in speakers if speaker]
+
     def _getSpeakers(self, request, nameFilter=None):
         """ Return speakers, with the option to filter on name
         """
-        speakers = Speaker.query()
-
         if nameFilter:
-            speakers.filter(Speaker.name == nameFilter)
+            speakers = Speaker.query(Speaker.name == nameFilter)
+        else:
+            speakers = self._getSpeakerIndex()
 
         return SpeakerForms(
             items=[self._copySpeakerToForm(speaker) for speaker in speakers]
@@ -880,7 +1840,7 @@ class ConferenceApi(remote.Service):
     def getSpeakers(self, request):
         """ Return all speakers
         """
-        return self._getSpeakers(request)
+        return fallback.serve('speakers')[0]
 
     @endpoints.method(SpeakerForm, SpeakerForm,
                       path='speaker',
@@ -899,10 +1859,14 @@ class ConferenceApi(remote.Service):
         pf = ProfileForm()
         for field in pf.all_fields():
             if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
+                # convert t-shirt string to Enum, and keys to websafe
+                # keys; just copy others
                 if field.name == 'teeShirtSize':
                     setattr(pf, field.name, getattr(TeeShirtSize,
                             getattr(prof, field.name)))
+                elif field.name == 'conferenceKeysToAttend':
+                    setattr(pf, field.name, [conf_key.urlsafe() for conf_key
+                            in getattr(prof, field.name)])
                 else:
                     setattr(pf, field.name, getattr(prof, field.name))
         pf.check_initialized()
@@ -919,7 +1883,12 @@ class ConferenceApi(remote.Service):
         # get Profile from datastore
         user_id = getUserId(user)
         prof_key = ndb.Key(Profile, user_id)
-        profile = prof_key.get()
+        return self._prepareProfile(user, prof_key, prof_key.get())
+
+    @staticmethod
+    def _prepareProfile(user, prof_key, profile):
+        """ Return a Profile that was read, creating it if non-existent
+        """
         # create new Profile if not there
         if not profile:
             profile = Profile(
@@ -929,6 +1898,10 @@ class ConferenceApi(remote.Service):
                 teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
             )
             profile.put()
+        else:
+            # registrations of profiles that haven't been migrated yet are
+            # converted in memory, and stored with the next put()
+            profile.migrateRegistrations()
 
         return profile      # return Profile
 
@@ -950,16 +1923,24 @@ class ConferenceApi(remote.Service):
                         # else:
                         #     setattr(prof, field, val)
                         prof.put()
+                        self._bumpVersions('profile:' + prof.key.id())
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
-    @endpoints.method(message_types.VoidMessage, ProfileForm,
+    @endpoints.method(CONDITIONAL_GET_REQUEST, ProfileForm,
                       path='profile', http_method='GET', name='getProfile')
     def getProfile(self, request):
         """ Return user profile
         """
-        return self._doProfile()
+        user_id = getUserId(self.get_authed_user())
+        etag, not_modified = self._getEtag(request, 'profile:' + user_id)
+        if not_modified:
+            return ProfileForm(etag=etag, notModified=True)
+
+        pf = self._doProfile()
+        pf.etag = etag
+        return pf
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
                       path='profile', http_method='POST', name='saveProfile')
@@ -997,8 +1978,12 @@ class ConferenceApi(remote.Service):
         if not request.websafeKey:
             raise endpoints.BadRequestException('Session websafeKey required')
 
-        session = ndb.Key(urlsafe=request.websafeKey)
-        if not session:
+        sess_key = self._parseWebsafeKeys([request.websafeKey], 'Session')[0]
+        if not sess_key:
+            raise endpoints.BadRequestException(
+                'Invalid session key: {}'.format(request.websafeKey))
+        session, conf = ndb.get_multi([sess_key, sess_key.parent()])
+        if not session or not conf or conf.deleted:
             raise endpoints.NotFoundException(
                 'No session found with key: {}'.format(request.websafeKey)
             )
@@ -1008,17 +1993,37 @@ class ConferenceApi(remote.Service):
                 for field in request.all_fields()}
         del data['websafeKey']
 
-        sess_key = ndb.Key(urlsafe=request.websafeKey)
         data['session'] = sess_key
 
         wishlist_id = Wishlist.allocate_ids(size=1, parent=prof_key)[0]
         wishlist_key = ndb.Key(Wishlist, wishlist_id, parent=prof_key)
         data['key'] = wishlist_key
+        data['counted'] = True
 
-        Wishlist(**data).put()
+        # the entry is counted in the transaction that stores it
+        @ndb.transactional(xg=True)
+        def create():
+            Wishlist(**data).put()
+            counters.incrementCounter(WISHLIST_COUNTER % request.websafeKey,
+                                      1, WISHLIST_COUNTER_SHARDS)
+        create()
 
         return self._copyWishlistToForm(wishlist_key.get())
 
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _deleteWishlistEntry(wishlist_key):
+        """ Delete a wishlist entry, and count it off if it was counted
+        """
+        wishlist = wishlist_key.get()
+        if not wishlist:
+            return
+        wishlist_key.delete()
+        if wishlist.counted:
+            counters.incrementCounter(
+                WISHLIST_COUNTER % wishlist.session.urlsafe(), -1,
+                WISHLIST_COUNTER_SHARDS)
+
     @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, WishlistForm,
                       path='profile/wishlist', http_method='POST',
                       name='createWishlist')
@@ -1029,18 +2034,26 @@ class ConferenceApi(remote.Service):
 
     def _getSessionsInWishlist(self):
         """ Helper method to get Sessions from the wishlist
+
+        Entries of sessions that no longer exist are left over by a deleted
+        conference whose cleanup hasn't reached them; they're left out, and
+        deleted.
         """
         user = self.get_authed_user()
         user_id = getUserId(user)
         prof_key = ndb.Key(Profile, user_id)
 
-        wish_keys = Wishlist.query(ancestor=prof_key)
-        sess_keys = [wish_key.session for wish_key in wish_keys]
+        wishlists = Wishlist.query(ancestor=prof_key).fetch()
+        sess_keys = [wishlist.session for wishlist in wishlists]
 
         if sess_keys in (None, []):
             raise endpoints.BadRequestException(
                 'No wishlist found: {}'.format(sess_keys))
-        return ndb.get_multi(sess_keys)
+        sessions = ndb.get_multi(sess_keys)
+        for wishlist, session in zip(wishlists, sessions):
+            if not session:
+                self._deleteWishlistEntry(wishlist.key)
+        return [session for session in sessions if session]
 
     @endpoints.method(message_types.VoidMessage, SessionForms,
                       path='profile/wishlist', http_method='GET',
@@ -1050,9 +2063,69 @@ class ConferenceApi(remote.Service):
         """
         sessions = self._getSessionsInWishlist()
 
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        return SessionForms(items=self._copySessionsToForms(sessions))
+
+    @staticmethod
+    def _getSessionInterval(session):
+        """ Return the start and end datetime of a session
+
+        Sessions stored before endTime was introduced get their end from
+        the duration. Returns None for sessions without date or startTime.
+        """
+        if not (session.date and session.startTime):
+            return None
+        start = datetime.combine(session.date, session.startTime)
+        if session.endTime:
+            end = datetime.combine(session.date, session.endTime)
+            if end < start:
+                # session runs past midnight
+                end += timedelta(days=1)
+        else:
+            end = start + timedelta(minutes=session.duration or 0)
+        return start, end
+
+    @endpoints.method(message_types.VoidMessage, SessionConflictForms,
+                      path='profile/wishlist/conflicts', http_method='GET',
+                      name='getWishlistConflicts')
+    def getWishlistConflicts(self, request):
+        """ Return groups of overlapping sessions in the user's wishlist
+
+        Sessions are sorted on start time and swept once; a session that
+        starts before the latest end time of the current group overlaps
+        with it.
+        """
+        user = self.get_authed_user()
+        prof_key = ndb.Key(Profile, getUserId(user))
+
+        sess_keys = set(wish.session
+                        for wish in Wishlist.query(ancestor=prof_key))
+        intervals = []
+        for session in ndb.get_multi(list(sess_keys)):
+            interval = session and self._getSessionInterval(session)
+            if interval:
+                intervals.append((interval, session))
+        intervals.sort(key=lambda item: item[0])
+
+        groups = []
+        group, group_end = [], None
+        for (start, end), session in intervals:
+            if group and start < group_end:
+                group.append(session)
+                group_end = max(group_end, end)
+            else:
+                if len(group) > 1:
+                    groups.append(group)
+                group, group_end = [session], end
+        if len(group) > 1:
+            groups.append(group)
+
+        speakers = self._getSessionSpeakers(
+            [session for group in groups for session in group])
+        return SessionConflictForms(items=[
+            SessionConflictForm(sessions=[
+                self._copySessionToForm(session, speakers)
+                for session in group])
+            for group in groups])
 
     def _updateSessionsInWishlist(self, request, add=True):
         """ Add or remove a Session from the Wishlist
@@ -1063,7 +2136,7 @@ class ConferenceApi(remote.Service):
         # Preload and validate necessary data items
         user = self.get_authed_user()
 
-        session = ndb.Key(urlsafe=request.websafeKey)
+        session = self._parseWebsafeKeys([request.websafeKey], 'Session')[0]
         if not session:
             raise endpoints.BadRequestException(
                 'No session found for key: {}'.format(request.websafeKey)
@@ -1083,16 +2156,15 @@ class ConferenceApi(remote.Service):
 
             return self._copySessionToForm(session.get())
         else:
-            sessions = wishlist.filter(Wishlist.session == session).fetch()
+            sessions = wishlist.filter(Wishlist.session == session).fetch(
+                keys_only=True)
             if len(sessions) != 0:
-                sessions[0].key.delete()
+                self._deleteWishlistEntry(sessions[0])
 
             updated_wishlist = self._getSessionsInWishlist()
 
             return SessionForms(
-                items=[self._copySessionToForm(item)
-                       for item in updated_wishlist]
-            )
+                items=self._copySessionsToForms(updated_wishlist))
 
     @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, SessionForm,
                       path='profile/wishlist/add', http_method='POST',
@@ -1115,6 +2187,73 @@ class ConferenceApi(remote.Service):
         """
         return self._updateSessionsInWishlist(request, add=False)
 
+    @staticmethod
+    def _computeTopSessions(cursor=None):
+        """ Compute the most wishlisted sessions of unarchived conferences
+
+        Handles one batch of conferences, and chains a task for the next
+        batch.
+        """
+        start = Cursor(urlsafe=cursor) if cursor else None
+        conf_keys, next_cursor, more = Conference.query(
+            Conference.archived == False).fetch_page(
+            TOP_SESSIONS_BATCH_SIZE, start_cursor=start, keys_only=True)
+        for conf_key in conf_keys:
+            ConferenceApi._storeTopSessions(conf_key)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/crons/compute_top_sessions')
+
+    @staticmethod
+    def _storeTopSessions(conf_key):
+        """ Store the TOP_SESSIONS most wishlisted sessions of a conference
+
+        They are stored as a JSON list, most wishlisted first, like:
+
+            [{'websafeKey': '<session_wsk>', 'name': '<name>',
+              'date': '<date>', 'startTime': '<time>', 'wishlisted': <n>},
+             ...]
+        """
+        sessions = Session.query(ancestor=conf_key).fetch()
+        counts = counters.getCounts(
+            [WISHLIST_COUNTER % session.key.urlsafe()
+             for session in sessions], WISHLIST_COUNTER_SHARDS)
+        ranked = sorted(
+            [(counts[WISHLIST_COUNTER % session.key.urlsafe()], session)
+             for session in sessions],
+            key=lambda item: (-item[0], item[1].name))
+        top = json.dumps([
+            {'websafeKey': session.key.urlsafe(),
+             'name': session.name,
+             'date': session.date and str(session.date),
+             'startTime': session.startTime and str(session.startTime),
+             'wishlisted': count}
+            for count, session in ranked[:TOP_SESSIONS] if count > 0])
+
+        wsck = conf_key.urlsafe()
+        TopSessions(id=wsck, data=top).put()
+        memcache.set(MEMCACHE_TOP_SESSIONS_KEY_PREFIX+wsck, top)
+        return top
+
+    @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, StringMessage,
+                      path='conference/{websafeKey}/sessions/top',
+                      http_method='GET', name='getTopSessions')
+    def getTopSessions(self, request):
+        """ Return the most wishlisted sessions of a conference
+
+        The list is returned as a JSON string, see _storeTopSessions(). It
+        is recomputed periodically, so it may lag behind the wishlists.
+        """
+        wsck = request.websafeKey
+        top = memcache.get(MEMCACHE_TOP_SESSIONS_KEY_PREFIX+wsck)
+        if top is None:
+            stored = ndb.Key(TopSessions, wsck).get()
+            # not computed yet when the conference is new
+            top = stored.data if stored else "[]"
+            memcache.set(MEMCACHE_TOP_SESSIONS_KEY_PREFIX+wsck, top)
+        return StringMessage(data=top)
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
@@ -1124,9 +2263,11 @@ class ConferenceApi(remote.Service):
         This is used by the memcache cron job & putAnnouncement().
         """
         confs = Conference.query(ndb.AND(
+            Conference.archived == False,
             Conference.seatsAvailable <= 5,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
+        cached = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or ""
 
         if confs:
             # If there are almost sold out conferences,
@@ -1140,60 +2281,481 @@ class ConferenceApi(remote.Service):
             announcement = ""
             memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
 
+        if announcement != cached:
+            ConferenceApi._bumpVersions('announcement')
         return announcement
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(CONDITIONAL_GET_REQUEST, StringMessage,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """ Return Announcement from memcache
         """
+        etag, not_modified = self._getEtag(request, 'announcement')
+        if not_modified:
+            return StringMessage(data='', etag=etag, notModified=True)
         return StringMessage(
-            data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+            data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "", etag=etag)
+
+
+# - - - Changes - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _addTombstones(keys):
+        """ Record deleted Conferences, Sessions or Speakers for the feed
+
+        Returns the futures of the puts.
+        """
+        return ndb.put_multi_async(
+            [Tombstone(kind=key.kind(), websafeKey=key.urlsafe())
+             for key in keys])
+
+    @staticmethod
+    def _parseChangesToken(token):
+        """ Return the position of every stream of a changes token
+
+        The position of a stream is (since, cursor): the stream is the
+        query of entities written after since, and the cursor (if any)
+        points into it.
+        """
+        streams = {}
+        if token:
+            try:
+                state = json.loads(base64.urlsafe_b64decode(str(token)))
+                for stream, (since, cursor) in state.items():
+                    streams[stream] = (
+                        datetime.strptime(since, TOKEN_TIME_FORMAT),
+                        Cursor(urlsafe=cursor) if cursor else None)
+            except (AttributeError, TypeError, ValueError,
+                    datastore_errors.BadValueError):
+                raise endpoints.BadRequestException('Invalid changes token')
+        return streams
+
+    @endpoints.method(CHANGES_GET_REQUEST, ChangesForm,
+                      path='changes', http_method='GET', name='getChanges')
+    def getChanges(self, request):
+        """ Return the conferences, sessions and speakers written, and the
+        ones deleted, since a token
+
+        Without a token everything is returned. Every response holds the
+        token to pass next; while more is set there are more changes
+        right away. Entities may be returned more than once, so clients
+        should apply changes by websafe key.
+        """
+        positions = self._parseChangesToken(request.token)
+        models = (('Conference', Conference, 'updated'),
+                  ('Session', Session, 'updated'),
+                  ('Speaker', Speaker, 'updated'),
+                  ('Tombstone', Tombstone, 'deleted'))
+
+        # fetch a page of every stream at once
+        pages = []
+        for stream, model, field in models:
+            since, cursor = positions.get(stream, (CHANGES_EPOCH, None))
+            prop = getattr(model, field)
+            pages.append((since, model.query(prop > since).order(
+                prop).fetch_page_async(CHANGES_PAGE_SIZE,
+                                       start_cursor=cursor)))
+
+        state = {}
+        results = {}
+        more = False
+        overlap_start = datetime.utcnow() - timedelta(
+            seconds=CHANGES_OVERLAP_SECONDS)
+        for (stream, model, field), (since, future) in zip(models, pages):
+            entities, cursor, stream_more = future.get_result()
+            results[stream] = entities
+            if stream_more and cursor:
+                # resume the same query
+                state[stream] = (since.strftime(TOKEN_TIME_FORMAT),
+                                 cursor.urlsafe())
+                more = True
+            else:
+                # start the next query at the latest write, but not within
+                # the overlap
+                latest = max([getattr(entity, field)
+                              for entity in entities] or [since])
+                since = max(since, min(latest, overlap_start))
+                state[stream] = (since.strftime(TOKEN_TIME_FORMAT), None)
+
+        conferences = results['Conference']
+        names = {prof.key.id(): prof.displayName for prof in ndb.get_multi(
+            list(set(ndb.Key(Profile, conf.organizerUserId)
+                     for conf in conferences))) if prof}
+        return ChangesForm(
+            conferences=[self._copyConferenceToForm(
+                conf, names.get(conf.organizerUserId))
+                for conf in conferences],
+            sessions=self._copySessionsToForms(results['Session']),
+            speakers=[self._copySpeakerToForm(speaker)
+                      for speaker in results['Speaker']],
+            deleted=[DeletedForm(kind=tomb.kind, websafeKey=tomb.websafeKey)
+                     for tomb in results['Tombstone']],
+            token=base64.urlsafe_b64encode(json.dumps(state)),
+            more=more)
+
+# - - - Archive - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _archiveConferences():
+        """ Archive conferences that have ended, with their sessions
+
+        Archives a batch of conferences, and chains a task for the next
+        batch. Archived conferences drop out of the query, so no cursor is
+        needed.
+        """
+        conf_keys = Conference.query(
+            Conference.archived == False,
+            Conference.endDate < datetime.today().date()).fetch(
+            ARCHIVE_BATCH_SIZE, keys_only=True)
+        archived = sum(1 for conf_key in conf_keys
+                       if ConferenceApi._archiveConference(conf_key))
+        logging.info('Archived %d conference(s)', archived)
+        if len(conf_keys) == ARCHIVE_BATCH_SIZE:
+            taskqueue.add(url='/crons/archive_conferences')
+
+    @staticmethod
+    @ndb.transactional
+    def _archiveConference(conf_key):
+        """ Archive a conference and its sessions in one transaction
+        """
+        conf = conf_key.get()
+        if not conf or conf.archived:
+            return False
+        conf.archived = True
+        sessions = Session.query(ancestor=conf_key).fetch()
+        for session in sessions:
+            session.archived = True
+        ndb.put_multi([conf] + sessions)
+        wsck = conf_key.urlsafe()
+        ConferenceApi._bumpVersions('conference:' + wsck, 'sessions:' + wsck)
+        cache.invalidate(conf_key)
+        return True
+
+
+# - - - Deletion - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _deleteConferenceBatch(wsck, stage, cursor=None):
+        """ Run one batch of deleting a conference, and chain the next
+
+        The stages of DELETE_STAGES run in order, in batches of at most
+        DELETE_BATCH_SIZE entities; every batch is idempotent, so a task
+        that is retried does no harm. Entities are deleted with
+        delete_multi_async, and the deleted sessions and the conference
+        are recorded as tombstones for the changes feed.
+        """
+        conf_key = ndb.Key(urlsafe=wsck)
+        start = Cursor(urlsafe=cursor) if cursor else None
+        done, next_cursor = getattr(
+            ConferenceApi, '_delete' + stage.capitalize())(conf_key, start)
+
+        if not done:
+            stage_next = stage
+        elif stage != DELETE_STAGES[-1]:
+            stage_next = DELETE_STAGES[DELETE_STAGES.index(stage) + 1]
+            next_cursor = None
+        else:
+            logging.info('Deleted conference %s', wsck)
+            return
+        params = {'conf_wsk': wsck, 'stage': stage_next}
+        if next_cursor:
+            params['cursor'] = next_cursor.urlsafe()
+        taskqueue.add(params=params, url='/tasks/delete_conference')
+
+    @staticmethod
+    def _deleteWishlists(conf_key, start):
+        """ Delete the wishlist entries of a batch of sessions
+
+        The batch is done again while any of its sessions has more than a
+        batch of entries.
+        """
+        session_keys, cursor, more = Session.query(
+            ancestor=conf_key).fetch_page(DELETE_WISHLIST_SESSIONS,
+                                          start_cursor=start, keys_only=True)
+        futures = [Wishlist.query(Wishlist.session == session_key).fetch_async(
+            DELETE_BATCH_SIZE, keys_only=True) for session_key in session_keys]
+        found = [future.get_result() for future in futures]
+        ndb.Future.wait_all(ndb.delete_multi_async(
+            [key for keys in found for key in keys]))
+
+        if any(len(keys) == DELETE_BATCH_SIZE for keys in found):
+            return False, start
+        return not (more and cursor), cursor
+
+    @staticmethod
+    def _deleteSessions(conf_key, start):
+        """ Delete a batch of sessions; deleted ones drop out of the
+        (ancestor) query, so no cursor is needed
+        """
+        session_keys = Session.query(ancestor=conf_key).fetch(
+            DELETE_BATCH_SIZE, keys_only=True)
+        ndb.Future.wait_all(ConferenceApi._addTombstones(session_keys) +
+                            ndb.delete_multi_async(session_keys))
+        return len(session_keys) < DELETE_BATCH_SIZE, None
+
+    @staticmethod
+    def _deleteRegistrations(conf_key, start):
+        """ Remove a batch of registrations from the profiles that hold them
+
+        Every profile is updated in its own transaction, all at once.
+        """
+        reg_keys, cursor, more = Registration.query(
+            Registration.conference == conf_key).fetch_page(
+            DELETE_BATCH_SIZE, start_cursor=start, keys_only=True)
+
+        @ndb.transactional_tasklet
+        def unregister(reg_key):
+            prof = yield reg_key.parent().get_async()
+            if prof and prof.isAttending(conf_key):
+                prof.removeConference(conf_key)
+                yield prof.put_async()
+                ConferenceApi._bumpVersions('profile:' + prof.key.id())
+            yield reg_key.delete_async()
+
+        ndb.Future.wait_all([unregister(reg_key) for reg_key in reg_keys])
+        return not (more and cursor), cursor
+
+    @staticmethod
+    def _deleteWaitlist(conf_key, start):
+        """ Delete a batch of the waitlist of the conference
+        """
+        entry_keys, cursor, more = WaitlistEntry.query(
+            WaitlistEntry.conference == conf_key).fetch_page(
+            DELETE_BATCH_SIZE, start_cursor=start, keys_only=True)
+        ndb.Future.wait_all(ndb.delete_multi_async(entry_keys))
+        return not (more and cursor), cursor
+
+    @staticmethod
+    def _deleteConference(conf_key, start):
+        """ Delete the conference and what is stored for it, and drop it
+        from the caches
+        """
+        wsck = conf_key.urlsafe()
+        ndb.Future.wait_all(ConferenceApi._addTombstones([conf_key]) +
+                            ndb.delete_multi_async([
+                                conf_key, ndb.Key(Timetable, wsck),
+                                ndb.Key(TopSessions, wsck)]))
+        memcache.delete_multi([MEMCACHE_FEATURED_KEY_PREFIX + wsck,
+                               MEMCACHE_TIMETABLE_KEY_PREFIX + wsck,
+                               MEMCACHE_TOP_SESSIONS_KEY_PREFIX + wsck])
+        # again, in case a refresh stored them since the conference was
+        # marked deleted
+        fallback.forget('conference', wsck)
+        fallback.forget('sessions', wsck)
+        cache.invalidate(conf_key)
+        ConferenceApi._bumpVersions('conference:' + wsck, 'sessions:' + wsck,
+                                    'featured:' + wsck)
+        # the announcement may name the conference
+        ConferenceApi._cacheAnnouncement()
+        return True, None
+
+# - - - Warmup - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _warmup():
+        """ Prime the caches read by the first requests of an instance
+
+        Fills the announcement and the speaker index when they are missing
+        from the caches, and has the featured speakers of current and
+        upcoming conferences recomputed when they are missing.
+        """
+        if memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) is None:
+            ConferenceApi._cacheAnnouncement()
+        ConferenceApi._getSpeakerIndex()
+
+        conferences = Conference.query(
+            Conference.endDate >= datetime.today().date()).fetch(
+            WARMUP_CONFERENCES)
+        wscks = [conf.key.urlsafe() for conf in conferences
+                 if not conf.deleted]
+        featured = memcache.get_multi(
+            wscks, key_prefix=MEMCACHE_FEATURED_KEY_PREFIX)
+        for wsck in wscks:
+            if wsck not in featured:
+                ConferenceApi._scheduleFeaturedSpeakers(wsck)
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """ Register or unregister user for selected conference
+
+        Registering for a sold out conference puts the user on its waitlist,
+        which is kept outside of the conference's entity group; as long as
+        anyone is waiting, new registrations join the waitlist too.
+        Unregistering (while others are waiting) hands the freed seat to the
+        next user on the waitlist, from a task.
+
+        The attendee count of the conference is a sharded counter, which is
+        updated by a task that commits with the registration.
+        """
+        wsck = request.websafeKey
+        conf_key = ndb.Key(urlsafe=wsck)
+        waiting = WaitlistEntry.query(
+            WaitlistEntry.conference == conf_key).get(keys_only=True)
+
+        if reg:
+            # check the seats before entering the contended transaction
+            conf = conf_key.get()
+            if not conf or conf.deleted:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % wsck)
+            if waiting or conf.seatsAvailable <= 0:
+                return self._joinWaitlist(conf_key)
+        elif self._leaveWaitlist(conf_key):
+            return RegistrationMessage(data=True)
+
+        retval = self._updateRegistration(request, reg,
+                                          promote=bool(waiting))
+        if retval is None:
+            # sold out while we were registering
+            return self._joinWaitlist(conf_key)
+        return RegistrationMessage(data=retval)
+
+    def _joinWaitlist(self, conf_key):
+        """ Put the user on the waitlist of a conference
+        """
+        prof = self._getProfileFromUser()
+        if prof.isAttending(conf_key):
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        entry_key = ndb.Key(WaitlistEntry, conf_key.urlsafe(),
+                            parent=prof.key)
+        if not entry_key.get():
+            WaitlistEntry(key=entry_key, conference=conf_key).put()
+        # a seat may have been freed by someone whose (eventually
+        # consistent) waitlist query didn't see this entry yet, and new
+        # registrations wait as long as anyone is waiting; so always have
+        # free seats handed out
+        self._enqueueCoalesced('/tasks/promote_waitlist', conf_key.urlsafe(),
+                               PROMOTE_WINDOW)
+        return RegistrationMessage(data=False, waitlisted=True)
+
+    def _leaveWaitlist(self, conf_key):
+        """ Take the user off the waitlist of a conference, if on it
+        """
+        prof_key = ndb.Key(Profile, getUserId(self.get_authed_user()))
+        entry_key = ndb.Key(WaitlistEntry, conf_key.urlsafe(),
+                            parent=prof_key)
+        if not entry_key.get():
+            return False
+        entry_key.delete()
+        return True
+
+    @staticmethod
+    def _promoteFromWaitlist(conf_wsk):
+        """ Register users from the waitlist of a conference for free seats
+
+        Users are promoted in the order they joined the waitlist, each in
+        its own transaction, until the conference is sold out again.
+        """
+        conf_key = ndb.Key(urlsafe=conf_wsk)
+        waiting = WaitlistEntry.query(
+            WaitlistEntry.conference == conf_key).order(WaitlistEntry.added)
+        for entry_key in waiting.iter(keys_only=True):
+            if ConferenceApi._promoteWaiter(entry_key) is None:
+                break
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _promoteWaiter(entry_key):
+        """ Register the user of a waitlist entry for its conference
+
+        Returns None when there are no seats left, and whether the user got
+        registered otherwise.
+        """
+        conf_key = ndb.Key(urlsafe=entry_key.id())
+        entry, conf, prof = ndb.get_multi(
+            [entry_key, conf_key, entry_key.parent()])
+        if not conf or conf.deleted or conf.seatsAvailable <= 0:
+            return None
+        if not (entry and prof):
+            # left the waitlist in the mean time
+            return False
+
+        entry_key.delete()
+        prof.migrateRegistrations()
+        if prof.isAttending(conf_key):
+            return False
+
+        prof.addConference(conf_key)
+        conf.seatsAvailable -= 1
+        Registration(key=ndb.Key(Registration, conf_key.urlsafe(),
+                                 parent=prof.key),
+                     conference=conf_key).put()
+        ndb.put_multi([prof, conf])
+        ConferenceApi._queueConfirmationEmail(
+            prof.mainEmail,
+            u'Registration: a seat became available for you at {}'.format(
+                conf.name))
+        cache.invalidate(conf_key)
+        ConferenceApi._bumpVersions('conference:' + conf_key.urlsafe(),
+                                    'profile:' + prof.key.id())
+        deltas = ConferenceApi._getAggregateDeltas(conf, 0, -1)
+        deltas[ATTENDEES_COUNTER % conf_key.urlsafe()] = 1
+        ConferenceApi._queueAggregates(deltas)
+        return True
+
+    @ndb.transactional(xg=True)
+    def _updateRegistration(self, request, reg, promote=False):
+        """ Update Profile, Registration and Conference in one transaction
+
+        Returns whether the registration changed (None when registering for
+        a conference that is sold out). Registrations from before the roster
+        existed have no Registration to take away (and don't count towards
+        the attendees), until the attendees migration adds it. When promote
+        is set, a freed seat goes to the waitlist.
         """
         retval = None
+        rostered = False
         prof = self._getProfileFromUser()  # get user Profile
 
         # check if conf exists given websafeConferenceKey
         # get conference; check that it exists
         wsck = request.websafeKey
         conf = ndb.Key(urlsafe=wsck).get()
-        if not conf:
+        if not conf or conf.deleted:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
+        # the roster entry lives in the profile's entity group, so it
+        # doesn't add an entity group to the transaction
+        reg_key = ndb.Key(Registration, wsck, parent=prof.key)
+
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if prof.isAttending(conf.key):
                 raise ConflictException(
                     "You have already registered for this conference")
 
             # check if seats avail
             if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+                return None
 
             # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
+            prof.addConference(conf.key)
             conf.seatsAvailable -= 1
-            retval = True
+            Registration(key=reg_key, conference=conf.key).put()
+            retval = rostered = True
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if prof.isAttending(conf.key):
 
                 # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
+                prof.removeConference(conf.key)
                 conf.seatsAvailable += 1
+                rostered = reg_key.get() is not None
+                if rostered:
+                    reg_key.delete()
+                if promote:
+                    taskqueue.add(params={'conf_wsk': wsck},
+                                  url='/tasks/promote_waitlist',
+                                  transactional=True)
                 retval = True
             else:
                 retval = False
@@ -1201,7 +2763,15 @@ class ConferenceApi(remote.Service):
         # write things back to the datastore & return
         prof.put()
         conf.put()
-        return BooleanMessage(data=retval)
+        if retval:
+            cache.invalidate(conf.key)
+            self._bumpVersions('conference:' + wsck,
+                               'profile:' + prof.key.id())
+            deltas = self._getAggregateDeltas(conf, 0, -1 if reg else 1)
+            if rostered:
+                deltas[ATTENDEES_COUNTER % wsck] = 1 if reg else -1
+            self._queueAggregates(deltas)
+        return retval
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='conferences/attending',
@@ -1210,40 +2780,143 @@ class ConferenceApi(remote.Service):
         """ Get list of conferences that user has registered for
         """
         prof = self._getProfileFromUser()  # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck)
-                     for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
 
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId)
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # start all lookups at once; the gets of conferences and of their
+        # organizers are batched into one RPC each
+        futures = [self._getConferenceWithOrganizer(conf_key)
+                   for conf_key in prof.conferenceKeysToAttend]
+        results = [future.get_result() for future in futures]
 
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(items=[
-            self._copyConferenceToForm(conf, names[conf.organizerUserId])
-            for conf in conferences]
+            self._copyConferenceToForm(conf, getattr(organizer, 'displayName',
+                                                     None))
+            for conf, organizer in results if conf]
         )
 
-    @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, BooleanMessage,
+    @ndb.tasklet
+    def _getConferenceWithOrganizer(self, conf_key):
+        """ Get a Conference and its organizer's Profile asynchronously
+        """
+        conf = yield conf_key.get_async()
+        if not conf or conf.deleted:
+            raise ndb.Return((None, None))
+        organizer = yield ndb.Key(Profile, conf.organizerUserId).get_async()
+        raise ndb.Return((conf, organizer))
+
+    @endpoints.method(ConferenceQueryForms, DashboardForm,
+                      path='dashboard', http_method='POST',
+                      name='getDashboard')
+    def getDashboard(self, request):
+        """ Return the conferences to attend, the announcement and the
+        queried conferences (like queryConferences) at once
+        """
+        self._checkRateLimit('getDashboard')
+        return self._getDashboard(request,
+                                  self.get_authed_user()).get_result()
+
+    @ndb.tasklet
+    def _getDashboard(self, request, user):
+        """ Build the DashboardForm with concurrent lookups
+
+        The Profile is read once, together with the conference query and
+        the announcement; the conferences to attend and the organizers of
+        the queried conferences are then read together, batched into one
+        get RPC.
+        """
+        prof_key = ndb.Key(Profile, getUserId(user))
+        prof, conferences, announcement = yield (
+            prof_key.get_async(),
+            self._getQuery(request).fetch_async(),
+            ndb.get_context().memcache_get(MEMCACHE_ANNOUNCEMENTS_KEY))
+        prof = self._prepareProfile(user, prof_key, prof)
+        conferences = [conf for conf in conferences if not conf.deleted]
+
+        organizer_keys = list(set(ndb.Key(Profile, conf.organizerUserId)
+                                  for conf in conferences))
+        attending, organizers = yield (
+            [self._getConferenceWithOrganizer(conf_key)
+             for conf_key in prof.conferenceKeysToAttend],
+            ndb.get_multi_async(organizer_keys))
+        names = {organizer.key.id(): organizer.displayName
+                 for organizer in organizers if organizer}
+
+        raise ndb.Return(DashboardForm(
+            conferencesToAttend=[
+                self._copyConferenceToForm(
+                    conf, getattr(organizer, 'displayName', None))
+                for conf, organizer in attending if conf],
+            announcement=announcement or "",
+            conferences=[
+                self._copyConferenceToForm(
+                    conf, names.get(conf.organizerUserId))
+                for conf in conferences]))
+
+    @endpoints.method(ATTENDEES_GET_REQUEST, AttendeeForms,
+                      path='conference/{websafeKey}/attendees',
+                      http_method='GET', name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """ Return a page of the attendees of a conference
+
+        Only the organizer of the conference may see its attendees. Pass
+        the returned nextPageToken as pageToken to get the next page.
+        """
+        user_id = getUserId(self.get_authed_user())
+        conf_key = ndb.Key(urlsafe=request.websafeKey)
+        if conf_key.parent().id() != user_id:
+            raise endpoints.ForbiddenException(
+                'Only the owner can list the attendees of the conference.')
+
+        start = request.pageToken and Cursor(urlsafe=request.pageToken)
+        page_size = min(max(request.pageSize or ATTENDEES_PAGE_SIZE, 1),
+                        ATTENDEES_MAX_PAGE_SIZE)
+        regs, cursor, more = Registration.query(
+            Registration.conference == conf_key).order(
+            Registration.registered).fetch_page(
+            page_size, start_cursor=start)
+        profiles = ndb.get_multi([reg.key.parent() for reg in regs])
+
+        return AttendeeForms(
+            items=[AttendeeForm(displayName=prof.displayName,
+                                mainEmail=prof.mainEmail,
+                                registered=str(reg.registered))
+                   for reg, prof in zip(regs, profiles) if prof],
+            nextPageToken=cursor.urlsafe() if more and cursor else None)
+
+    @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, IntegerMessage,
+                      path='conference/{websafeKey}/attendees/count',
+                      http_method='GET', name='getConferenceAttendeeCount')
+    def getConferenceAttendeeCount(self, request):
+        """ Return the number of attendees of a conference
+        """
+        return IntegerMessage(data=counters.getCount(
+            ATTENDEES_COUNTER % request.websafeKey))
+
+    @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, RegistrationMessage,
                       path='conference/{websafeKey}/register',
                       http_method='POST', name='registerForConference')
     def registerForConference(self, request):
         """ Register user for selected conference
+
+        When the conference is sold out, the user is put on its waitlist
+        (data is false, and waitlisted is true).
         """
         return self._conferenceRegistration(request)
 
-    @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, BooleanMessage,
+    @endpoints.method(GENERIC_WEBSAFEKEY_REQUEST, RegistrationMessage,
                       path='conference/{websafeKey}/unregister',
                       http_method='DELETE', name='unregisterFromConference')
     def unregisterFromConference(self, request):
-        """ Unregister user for selected conference
+        """ Unregister user for selected conference, or leave its waitlist
         """
         return self._conferenceRegistration(request, reg=False)
 
+# read responses that are served stale while the datastore is slow
+fallback.register('conference', ConferenceForm,
+                  lambda wsck: ConferenceApi()._getConferenceForm(wsck))
+fallback.register('sessions', SessionForms,
+                  lambda wsck: ConferenceApi()._getSessions(wsck))
+fallback.register('speakers', SpeakerForms,
+                  lambda _: ConferenceApi()._getSpeakers(None))
+
 api = endpoints.api_server([ConferenceApi])  # register API
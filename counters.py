@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""counters.py
+
+Udacity conference server-side Python App Engine sharded counters
+
+A counter is spread over a number of shard entities, so that concurrent
+increments don't contend on a single entity group. Totals are cached in
+memcache and kept up to date on increments, so reading a counter normally
+costs a single memcache get, and at worst one get_multi over its shards.
+
+Counter groups record the members of a family of counters (like the cities
+conferences are counted for), so the family can be listed without a query.
+
+Increments that belong to a batch (like a task that may be retried) are
+applied at most once per batch: every transaction of the batch stores a
+marker, and is skipped when its marker exists. Old markers are purged.
+
+$Id$
+
+"""
+
+import random
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+NUM_SHARDS = 20
+MEMCACHE_TOTAL_KEY_PREFIX = "SHARDED_COUNTER_"
+MEMCACHE_GROUP_KEY_PREFIX = "COUNTER_GROUP_"
+# entity groups a cross-group transaction may touch
+MAX_XG_ENTITY_GROUPS = 25
+# batches are only retried for so long
+BATCH_MARKER_LIFETIME = timedelta(days=7)
+
+
+class CounterShard(ndb.Model):
+    """Shard of a named counter, keyed by '<name>:<shard index>'"""
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class CounterBatch(ndb.Model):
+    """Marks part of a batch of increments as applied, keyed by
+    '<batch id>:<part index>'"""
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class CounterGroup(ndb.Model):
+    """Members of a family of counters, keyed by the name of the group"""
+    members = ndb.StringProperty(repeated=True, indexed=False)
+
+
+def _shardKeys(name, shards):
+    return [ndb.Key(CounterShard, u'{}:{}'.format(name, index))
+            for index in range(shards)]
+
+
+@ndb.transactional(xg=True)
+def _incrementShards(shard_deltas, marker_key=None):
+    keys = [shard_key for shard_key, _ in shard_deltas]
+    shards = ndb.get_multi(keys + [marker_key] if marker_key else keys)
+    if marker_key and shards.pop():
+        return False
+    for index, (shard_key, delta) in enumerate(shard_deltas):
+        shards[index] = shards[index] or CounterShard(key=shard_key)
+        shards[index].count += delta
+    if marker_key:
+        shards.append(CounterBatch(key=marker_key))
+    ndb.put_multi(shards)
+    return True
+
+
+def incrementCounters(deltas, shards=NUM_SHARDS, batch_id=None):
+    """Add the deltas (which may be negative) of a dict to named counters
+
+    Every delta goes to a randomly picked shard of its counter, and the
+    shards are updated in as few transactions as possible. Within a
+    cross-group transaction the shards join it (one entity group per
+    counter, so only for a few counters), and the cached totals are
+    adjusted once it has committed; otherwise call this outside of other
+    transactions.
+
+    With a batch_id (unique to the batch, like the name of the task that
+    applies it) the deltas are applied at most once: the transactions
+    that already committed for the batch are skipped when it's retried.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    # a retried batch must be split up the same way
+    names = sorted(deltas)
+    size = MAX_XG_ENTITY_GROUPS - (1 if batch_id else 0)
+    applied = {}
+    for index, start in enumerate(range(0, len(names), size)):
+        part = names[start:start + size]
+        marker_key = (ndb.Key(CounterBatch, u'{}:{}'.format(batch_id, index))
+                      if batch_id else None)
+        if _incrementShards([(random.choice(_shardKeys(name, shards)),
+                              deltas[name]) for name in part], marker_key):
+            applied.update((name, deltas[name]) for name in part)
+    if applied:
+        # only adjust cached totals; a missing total is summed on next read
+        ndb.get_context().call_on_commit(lambda: memcache.offset_multi(
+            applied, key_prefix=MEMCACHE_TOTAL_KEY_PREFIX))
+
+
+def purgeBatchMarkers(limit=1000):
+    """Delete the markers of batches that are no longer retried
+
+    Returns whether more may be left.
+    """
+    keys = CounterBatch.query(
+        CounterBatch.created < datetime.now() - BATCH_MARKER_LIFETIME
+    ).fetch(limit, keys_only=True)
+    ndb.delete_multi(keys)
+    return len(keys) == limit
+
+
+def incrementCounter(name, delta=1, shards=NUM_SHARDS):
+    """Add delta (which may be negative) to a named counter"""
+    incrementCounters({name: delta}, shards)
+
+
+def getCounts(names, shards=NUM_SHARDS):
+    """Return a dict with the totals of the named counters
+
+    Totals missing from memcache are summed from their shards, with a
+    single get_multi for all of them.
+    """
+    totals = memcache.get_multi(names, key_prefix=MEMCACHE_TOTAL_KEY_PREFIX)
+    missing = [name for name in names if name not in totals]
+    if missing:
+        shard_keys = []
+        for name in missing:
+            shard_keys.extend(_shardKeys(name, shards))
+        stored = ndb.get_multi(shard_keys)
+        for index, name in enumerate(missing):
+            totals[name] = sum(shard.count for shard in
+                               stored[index * shards:(index + 1) * shards]
+                               if shard)
+        memcache.add_multi({name: totals[name] for name in missing},
+                           key_prefix=MEMCACHE_TOTAL_KEY_PREFIX)
+    return {name: int(totals[name]) for name in names}
+
+
+def getCount(name, shards=NUM_SHARDS):
+    """Return the total of a named counter"""
+    return getCounts([name], shards)[name]
+
+
+def getGroups(groups):
+    """Return a dict with the members of the named counter groups"""
+    members = memcache.get_multi(groups, key_prefix=MEMCACHE_GROUP_KEY_PREFIX)
+    missing = [group for group in groups if group not in members]
+    if missing:
+        stored = ndb.get_multi([ndb.Key(CounterGroup, group)
+                                for group in missing])
+        for group, entity in zip(missing, stored):
+            members[group] = entity.members if entity else []
+        memcache.add_multi({group: members[group] for group in missing},
+                           key_prefix=MEMCACHE_GROUP_KEY_PREFIX)
+    return members
+
+
+@ndb.transactional
+def _addToGroup(group, member):
+    entity = (ndb.Key(CounterGroup, group).get() or
+              CounterGroup(id=group))
+    if member not in entity.members:
+        entity.members.append(member)
+        entity.put()
+
+
+def addToGroups(memberships):
+    """Add members to counter groups, from a list of (group, member) pairs
+
+    Only members that are new to their group cost a transaction.
+    """
+    members = getGroups(list(set(group for group, _ in memberships)))
+    for group, member in set(memberships):
+        if member not in members[group]:
+            _addToGroup(group, member)
+            memcache.delete(MEMCACHE_GROUP_KEY_PREFIX + group)
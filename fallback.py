@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""fallback.py
+
+Udacity conference server-side Python App Engine stale-while-revalidate
+responses for read endpoints
+
+Read endpoints whose data rarely changes keep their last good response,
+serialized with protojson, in memcache. While the datastore is healthy
+responses are computed as usual, and the last good copy of a response is
+refreshed at most every STORE_INTERVAL seconds. A response that takes longer
+than LATENCY_BUDGET seconds, or fails with a datastore timeout, counts as a
+failure; after BREAKER_FAILURES failures in a row the circuit breaker of the
+instance opens for BREAKER_OPEN_SECONDS. While it is open, last good
+responses are served straight from memcache, and a task recomputes them in
+the background; after that, calls go to the datastore again, and a single
+failure opens the breaker again (half-open).
+
+A call that is over budget still returns its own (fresh) response: the
+datastore calls of a read path can't be abandoned midway, so the budget
+decides when the breaker opens, not when a single call gives up.
+
+$Id$
+
+"""
+
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+from protorpc import protojson
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.runtime import apiproxy_errors
+
+LATENCY_BUDGET = 0.5
+BREAKER_FAILURES = 3
+BREAKER_OPEN_SECONDS = 30
+STORE_INTERVAL = 60
+REFRESH_INTERVAL = 30
+LAST_GOOD_TTL = 86400
+MEMCACHE_LAST_GOOD_KEY_PREFIX = "LAST_GOOD_"
+REFRESH_URL = '/tasks/refresh_response'
+# responses whose store and refresh times an instance remembers
+MAX_NAMES = 2000
+DATASTORE_ERRORS = (datastore_errors.Timeout,
+                    datastore_errors.InternalError,
+                    apiproxy_errors.DeadlineExceededError)
+
+# kind -> (response message class, compute(arg))
+_responses = {}
+_lock = threading.Lock()
+# failures in a row, and until when the breaker is open
+_breaker = {'failures': 0, 'open_until': 0.0}
+# response name -> when it was last stored, or last scheduled for refresh,
+# least recently used first
+_stored = OrderedDict()
+_refreshed = OrderedDict()
+_stats = {'fresh': 0, 'stale': 0, 'failures': 0}
+
+
+def register(kind, response_type, compute):
+    """Add a kind of response, computed by compute(arg)"""
+    _responses[kind] = (response_type, compute)
+
+
+def _name(kind, arg):
+    return u'{}:{}'.format(kind, arg)
+
+
+def _isOpen():
+    with _lock:
+        return time.time() < _breaker['open_until']
+
+
+def _setTime(times, name, now):
+    """Remember when something happened to a response (holding _lock)"""
+    times.pop(name, None)
+    times[name] = now
+    while len(times) > MAX_NAMES:
+        times.popitem(last=False)
+
+
+def _recordCall(failed):
+    with _lock:
+        if not failed:
+            _breaker['failures'] = 0
+            return
+        _stats['failures'] += 1
+        _breaker['failures'] += 1
+        if _breaker['failures'] >= BREAKER_FAILURES:
+            _breaker['open_until'] = time.time() + BREAKER_OPEN_SECONDS
+            # half-open once it closes: the next failure reopens it
+            _breaker['failures'] = BREAKER_FAILURES - 1
+            logging.warning('Datastore circuit breaker open for %d s',
+                            BREAKER_OPEN_SECONDS)
+
+
+def _store(name, response, force=False):
+    now = time.time()
+    with _lock:
+        if not force and now < _stored.get(name, 0) + STORE_INTERVAL:
+            return
+        _setTime(_stored, name, now)
+    memcache.set(MEMCACHE_LAST_GOOD_KEY_PREFIX + name,
+                 protojson.encode_message(response), time=LAST_GOOD_TTL)
+
+
+def _getStale(kind, arg):
+    """Return the last good response, and schedule its refresh, or None"""
+    name = _name(kind, arg)
+    stored = memcache.get(MEMCACHE_LAST_GOOD_KEY_PREFIX + name)
+    if stored is None:
+        return None
+
+    now = time.time()
+    with _lock:
+        schedule = now >= _refreshed.get(name, 0) + REFRESH_INTERVAL
+        if schedule:
+            _setTime(_refreshed, name, now)
+        _stats['stale'] += 1
+    if schedule:
+        # named per interval, so instances don't pile up refreshes
+        bucket = int(now // REFRESH_INTERVAL)
+        try:
+            taskqueue.add(
+                name='refresh-{}-{}-{}'.format(kind, arg or '_', bucket),
+                url=REFRESH_URL, params={'kind': kind, 'arg': arg})
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+    return protojson.decode_message(_responses[kind][0], stored)
+
+
+def serve(kind, arg=''):
+    """Return a response of a registered kind, and whether it is stale
+
+    Stale responses are served when the breaker is open, or when the
+    datastore fails and there is a last good response.
+    """
+    if _isOpen():
+        stale = _getStale(kind, arg)
+        if stale is not None:
+            return stale, True
+
+    start = time.time()
+    try:
+        response = _responses[kind][1](arg)
+    except DATASTORE_ERRORS:
+        _recordCall(failed=True)
+        stale = _getStale(kind, arg)
+        if stale is None:
+            raise
+        return stale, True
+    _recordCall(failed=time.time() - start > LATENCY_BUDGET)
+
+    _store(_name(kind, arg), response)
+    with _lock:
+        _stats['fresh'] += 1
+    return response, False
+
+
+def refresh(kind, arg=''):
+    """Recompute and store the last good response (run by the task)
+
+    Tasks of kinds that aren't registered (any more) are logged and
+    dropped.
+    """
+    if kind not in _responses:
+        logging.warning('Not refreshing unknown response kind %r', kind)
+        return
+    _store(_name(kind, arg), _responses[kind][1](arg), force=True)
+
+
+def forget(kind, arg=''):
+    """Drop the last good response of something that no longer exists"""
+    memcache.delete(MEMCACHE_LAST_GOOD_KEY_PREFIX + _name(kind, arg))
+
+
+def getStats():
+    """Return the number of fresh and stale responses and the failures
+    counted by the breaker of this instance"""
+    with _lock:
+        return dict(_stats)
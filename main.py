@@ -12,10 +12,35 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+import logging
+import time
+
+import endpoints
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
 from conference import ConferenceApi
+from conference import CONFIRMATION_EMAIL_QUEUE
+import counters
+import fallback
+
+# Confirmation lines stay leased while a digest is being sent; a digest that
+# fails is retried by the next run once the lease expires.
+DIGEST_LEASE_SECONDS = 300
+DIGEST_MAX_LINES = 1000
+DIGEST_RUN_SECONDS = 240
+
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """ Prepare a new instance before it serves user requests
+
+        Importing this module has already loaded conference.py and built
+        the API server; this primes the caches of the first requests.
+        """
+        started = time.time()
+        ConferenceApi._warmup()
+        logging.info('Warmed up in %.0f ms', (time.time() - started) * 1000)
+        self.response.set_status(204)
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
@@ -25,31 +50,185 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
-class SendConfirmationEmailHandler(webapp2.RequestHandler):
+class ArchiveConferencesHandler(webapp2.RequestHandler):
+    def get(self):
+        """ Archive conferences that have ended
+        """
+        ConferenceApi._archiveConferences()
+        self.response.set_status(204)
+
+    def post(self):
+        """ Archive the next batch of conferences that have ended
+        """
+        ConferenceApi._archiveConferences()
+
+
+class ComputeTopSessionsHandler(webapp2.RequestHandler):
+    def get(self):
+        """ Start computing the most wishlisted sessions per conference
+        """
+        ConferenceApi._computeTopSessions()
+        self.response.set_status(204)
+
     def post(self):
-        """Send email confirming Conference creation."""
+        """ Compute the most wishlisted sessions of the next conferences
+        """
+        ConferenceApi._computeTopSessions(self.request.get('cursor'))
+
+
+class SendConfirmationEmailsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send queued confirmations as one digest email per recipient.
+
+        Every run coalesces all confirmation lines that were queued for a
+        recipient since the previous run (see cron.yaml for the window).
+        """
+        # the mail and taskqueue APIs are only needed here; don't load them
+        # on every instance
+        from google.appengine.api import mail
+        from google.appengine.api import taskqueue
+
+        queue = taskqueue.Queue(CONFIRMATION_EMAIL_QUEUE)
+        deadline = time.time() + DIGEST_RUN_SECONDS
+        sent = 0
+        while time.time() < deadline:
+            # lease the lines sharing the tag (recipient) of the oldest one
+            tasks = queue.lease_tasks_by_tag(DIGEST_LEASE_SECONDS,
+                                             DIGEST_MAX_LINES)
+            if not tasks:
+                break
+            try:
+                self._sendDigest(tasks[0].tag,
+                                 [task.payload.decode('utf-8')
+                                  for task in tasks])
+            except mail.Error:
+                logging.exception('Sending digest to %s failed',
+                                  tasks[0].tag)
+                continue
+            queue.delete_tasks(tasks)
+            sent += 1
+        logging.info('Sent %d confirmation digest(s)', sent)
+        self.response.set_status(204)
+
+    def _sendDigest(self, email, lines):
+        from google.appengine.api import app_identity
+        from google.appengine.api import mail
+
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
+            email,                                      # to
+            'Your conference updates (%d)' % len(lines),  # subj
+            u'Hi, the following has been confirmed for you:\r\n\r\n%s' % (
+                u'\r\n'.join(u'- ' + line for line in lines))
         )
 
 
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
-        """ Check if speaker is featured speaker
+        """ Recompute the featured speakers of a conference
+        """
+        ConferenceApi._updateFeaturedSpeakers(self.request.get('conf_wsk'))
+
+
+class BuildTimetableHandler(webapp2.RequestHandler):
+    def post(self):
+        """ Rebuild the timetable of a conference
+        """
+        ConferenceApi._buildTimetable(self.request.get('conf_wsk'))
+
+
+class MigrationStatusHandler(webapp2.RequestHandler):
+    def get(self):
+        """ Show the progress of all migrations as JSON
+        """
+        # admin only; don't load the migrations on every instance
+        import migrations
+
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(migrations.getStatus(), indent=2))
+
+
+class MigrationHandler(webapp2.RequestHandler):
+    def get(self, name):
+        """ Start or resume a migration
+        """
+        import migrations
+
+        restart = bool(self.request.get('restart'))
+        try:
+            migrations.start(name, restart=restart)
+        except KeyError:
+            self.abort(404)
+        self.redirect('/tasks/migrations')
+
+    def post(self, name):
+        """ Migrate the next batches of a migration
+        """
+        import migrations
+
+        migrations.runBatches(name, int(self.request.get('run')))
+
+
+class DeleteConferenceHandler(webapp2.RequestHandler):
+    def post(self):
+        """ Delete the next batch of a deleted conference
+        """
+        ConferenceApi._deleteConferenceBatch(
+            self.request.get('conf_wsk'), self.request.get('stage'),
+            self.request.get('cursor') or None)
+
+
+class RefreshResponseHandler(webapp2.RequestHandler):
+    def post(self):
+        """ Recompute the last good copy of a read response
+        """
+        try:
+            fallback.refresh(self.request.get('kind'),
+                             self.request.get('arg'))
+        except endpoints.NotFoundException as e:
+            # gone since it was stored; retrying won't bring it back
+            logging.info('Not refreshing: %s', e)
+
+
+class ApplyCountersHandler(webapp2.RequestHandler):
+    def post(self):
+        """ Apply changes to counters, queued with the changes they count
+        """
+        ConferenceApi._applyAggregates(
+            self.request.get('deltas'), self.request.get('memberships'),
+            self.request.headers['X-AppEngine-TaskName'])
+
+
+class PurgeCounterBatchesHandler(webapp2.RequestHandler):
+    def get(self):
+        """ Delete the markers of counter batches that are no longer retried
+        """
+        while counters.purgeBatchMarkers():
+            pass
+        self.response.set_status(204)
+
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """ Register users from the waitlist of a conference for free seats
         """
-        ConferenceApi._updateFeaturedSpeakers(
-            self.request.get('conf_wsk'),
-            self.request.get('schedule'))
+        ConferenceApi._promoteFromWaitlist(self.request.get('conf_wsk'))
 
 
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
-    ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/crons/send_confirmation_emails', SendConfirmationEmailsHandler),
+    ('/crons/archive_conferences', ArchiveConferencesHandler),
+    ('/crons/compute_top_sessions', ComputeTopSessionsHandler),
+    ('/crons/purge_counter_batches', PurgeCounterBatchesHandler),
     ('/tasks/set_featured_speakers', SetFeaturedSpeakerHandler),
+    ('/tasks/build_timetable', BuildTimetableHandler),
+    ('/tasks/migrations', MigrationStatusHandler),
+    (r'/tasks/migrations/(\w+)', MigrationHandler),
+    ('/tasks/promote_waitlist', PromoteWaitlistHandler),
+    ('/tasks/refresh_response', RefreshResponseHandler),
+    ('/tasks/delete_conference', DeleteConferenceHandler),
+    ('/tasks/apply_counters', ApplyCountersHandler),
 ], debug=True)
@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+
+"""migrations.py
+
+Udacity conference server-side Python App Engine batch migrations
+
+A migration goes over the entities of a query in batches, chained with
+cursors: every entity of a batch that needs migrating is read again and
+migrated in its own transaction (so concurrent writes aren't overwritten by
+the copy the query returned), after which the cursor and the totals are
+checkpointed in a MigrationState entity, in a transaction that only succeeds
+if no other task checkpointed the batch first (so resuming a migration whose
+chain is still running doesn't leave two chains running). A task handles
+batches until TASK_RUN_SECONDS have passed, and then chains a task for the
+rest, so it stays well within the task deadline. A task that
+fails is retried by the task queue, and resumes from the last checkpoint;
+a batch may therefore be migrated twice, so migrations must be idempotent.
+
+Migrations are started (or resumed) by an admin through main.py:
+
+    /tasks/migrations                   status of all migrations
+    /tasks/migrations/<name>            start or resume a migration
+    /tasks/migrations/<name>?restart=1  run a finished migration again
+
+$Id$
+
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timedelta
+import logging
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import counters
+from conference import ATTENDEES_COUNTER
+from conference import ConferenceApi
+from conference import WISHLIST_COUNTER
+from conference import WISHLIST_COUNTER_SHARDS
+from models import Conference
+from models import Profile
+from models import Registration
+from models import Session
+from models import Speaker
+from models import Wishlist
+
+TASK_RUN_SECONDS = 300
+MIGRATIONS_URL = '/tasks/migrations/%s'
+
+# name -> Migration, in the order they were added
+MIGRATIONS = OrderedDict()
+
+
+class MigrationState(ndb.Model):
+    """Progress of a migration, keyed by its name"""
+    run       = ndb.IntegerProperty(default=0, indexed=False)
+    cursor    = ndb.StringProperty(indexed=False)
+    done      = ndb.BooleanProperty(default=False, indexed=False)
+    batches   = ndb.IntegerProperty(default=0, indexed=False)
+    processed = ndb.IntegerProperty(default=0, indexed=False)
+    updated   = ndb.IntegerProperty(default=0, indexed=False)
+    # seconds spent migrating, summed over tasks
+    elapsed   = ndb.FloatProperty(default=0.0, indexed=False)
+    started   = ndb.DateTimeProperty(indexed=False)
+    finished  = ndb.DateTimeProperty(indexed=False)
+
+
+class Migration(object):
+    """Base class of migrations; subclasses are added with @register"""
+    name = None
+    batch_size = 100
+
+    def query(self):
+        """Return the query of the entities to migrate"""
+        raise NotImplementedError
+
+    def migrate(self, entities):
+        """Migrate a batch of entities, and return the ones to put"""
+        raise NotImplementedError
+
+    def migrateBatch(self, entities):
+        """Migrate and write a batch, and return the number of updates
+
+        Entities that need migrating (going by the copies the query
+        returned) are read again and migrated in a transaction each, and
+        skipped when they are gone or were migrated in the mean time.
+        Migrations that write more than the entities override this instead
+        of migrate.
+        """
+        @ndb.transactional
+        def migrate(key):
+            entity = key.get()
+            changed = self.migrate([entity]) if entity else []
+            ndb.put_multi(changed)
+            return bool(changed)
+
+        return sum(1 for entity in entities
+                   if self.migrate([entity]) and migrate(entity.key))
+
+
+def register(cls):
+    """Class decorator that adds a Migration under its name"""
+    MIGRATIONS[cls.name] = cls()
+    return cls
+
+
+def _enqueue(state):
+    """Chain the task for the next batches of a migration
+
+    The task is named after the run and the batches done, so a task that
+    is retried can't chain a second task.
+    """
+    try:
+        taskqueue.add(
+            name='migration-%s-%d-%d' % (state.key.id().replace('_', '-'),
+                                         state.run, state.batches),
+            url=MIGRATIONS_URL % state.key.id(), params={'run': state.run})
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+@ndb.transactional
+def _startState(name, restart):
+    state = MigrationState.get_by_id(name)
+    if state and not state.done:
+        # resume
+        return state, True
+    if state and not restart:
+        return state, False
+    state = state or MigrationState(id=name)
+    state.populate(run=state.run + 1, cursor=None, done=False, batches=0,
+                   processed=0, updated=0, elapsed=0.0,
+                   started=datetime.utcnow(), finished=None)
+    state.put()
+    return state, True
+
+
+def start(name, restart=False):
+    """Start a migration, or resume it when it's unfinished
+
+    A finished migration is only run again when restart is set. Returns
+    the MigrationState.
+    """
+    if name not in MIGRATIONS:
+        raise KeyError(name)
+    state, running = _startState(name, restart)
+    if running:
+        _enqueue(state)
+    return state
+
+
+@ndb.transactional
+def _checkpoint(name, run, start_cursor, processed, updated, elapsed,
+                cursor, done):
+    """Record a batch that started at start_cursor
+
+    Returns the MigrationState, or None when the migration moved on from
+    start_cursor in the mean time; a migration that is resumed while its
+    chain is still running has two chains for a moment, and the one that
+    loses a checkpoint stops.
+    """
+    state = MigrationState.get_by_id(name)
+    if (not state or state.done or state.run != run or
+            state.cursor != start_cursor):
+        return None
+    state.batches += 1
+    state.processed += processed
+    state.updated += updated
+    state.elapsed += elapsed
+    state.cursor = cursor
+    if done:
+        state.done = True
+        state.finished = datetime.utcnow()
+    state.put()
+    return state
+
+
+def runBatches(name, run):
+    """Migrate batches until done or out of time, then chain a task"""
+    migration = MIGRATIONS[name]
+    state = MigrationState.get_by_id(name)
+    if not state or state.done or state.run != run:
+        # a task of a previous run, or the migration was restarted
+        return
+
+    task_started = time.time()
+    processed = 0
+    while time.time() - task_started < TASK_RUN_SECONDS:
+        batch_started = time.time()
+        start_cursor = state.cursor and Cursor(urlsafe=state.cursor)
+        entities, cursor, more = migration.query().fetch_page(
+            migration.batch_size, start_cursor=start_cursor)
+        updated = migration.migrateBatch(entities)
+
+        state = _checkpoint(name, run, state.cursor,
+                            len(entities), updated,
+                            time.time() - batch_started,
+                            cursor.urlsafe() if cursor else None,
+                            not (more and cursor))
+        if not state:
+            # another task checkpointed this batch first
+            logging.info('Migration %s: stopping a second chain of run %d',
+                         name, run)
+            return
+        processed += len(entities)
+        if state.done:
+            break
+
+    elapsed = time.time() - task_started
+    logging.info('Migration %s: %d entities in %.1f s (%.0f/s), %d in '
+                 'total, %d updated%s', name, processed, elapsed,
+                 processed / elapsed if elapsed else 0, state.processed,
+                 state.updated, ', done' if state.done else '')
+    if not state.done:
+        _enqueue(state)
+
+
+def getStatus():
+    """Return the progress of all migrations, as a list of dicts"""
+    states = ndb.get_multi([ndb.Key(MigrationState, name)
+                            for name in MIGRATIONS])
+    status = []
+    for name, state in zip(MIGRATIONS, states):
+        if not state:
+            status.append({'name': name, 'status': 'not started'})
+            continue
+        status.append({
+            'name': name,
+            'status': 'done' if state.done else 'running',
+            'run': state.run,
+            'batches': state.batches,
+            'processed': state.processed,
+            'updated': state.updated,
+            'seconds': round(state.elapsed, 1),
+            'perSecond': round(state.processed / state.elapsed, 1)
+            if state.elapsed else None,
+            'started': str(state.started),
+            'finished': state.finished and str(state.finished),
+        })
+    return status
+
+
+# - - - Migrations - - - - - - - - - - - - - - - - - - - - -
+
+@register
+class RegistrationKeys(Migration):
+    """Convert registrations of Profiles from websafe strings to keys
+
+    Every profile that needs converting is converted in its own
+    transaction, so concurrent registrations aren't lost.
+    """
+    name = 'registration_keys'
+
+    def query(self):
+        return Profile.query()
+
+    def migrateBatch(self, profiles):
+        @ndb.transactional
+        def migrate(prof_key):
+            prof = prof_key.get()
+            if prof.migrateRegistrations():
+                prof.put()
+                return True
+            return False
+
+        return sum(1 for prof in profiles
+                   if prof.legacyConferenceKeysToAttend and migrate(prof.key))
+
+
+@register
+class Attendees(Migration):
+    """Build the attendee index from the registrations in Profiles
+
+    Registrations that are already indexed are skipped. The missing ones of
+    a profile are added in a transaction that reads the profile again, and
+    are counted once that has committed, so a registration is never indexed
+    (or counted) for a user who unregistered in the mean time, nor counted
+    twice.
+    """
+    name = 'attendees'
+
+    def query(self):
+        return Profile.query()
+
+    def migrate(self, profiles):
+        for prof in profiles:
+            # include registrations of profiles not migrated yet
+            prof.migrateRegistrations()
+
+        reg_keys = [ndb.Key(Registration, conf_key.urlsafe(), parent=prof.key)
+                    for prof in profiles
+                    for conf_key in prof.conferenceKeysToAttend]
+        return [Registration(key=reg_key,
+                             conference=ndb.Key(urlsafe=reg_key.id()))
+                for reg_key, reg in zip(reg_keys, ndb.get_multi(reg_keys))
+                if not reg]
+
+    def migrateBatch(self, profiles):
+        @ndb.transactional
+        def migrate(prof_key):
+            prof = prof_key.get()
+            new_regs = self.migrate([prof]) if prof else []
+            ndb.put_multi(new_regs)
+            return new_regs
+
+        new_regs = [reg for prof in profiles if self.migrate([prof])
+                    for reg in migrate(prof.key)]
+        added = {}
+        for reg in new_regs:
+            name = ATTENDEES_COUNTER % reg.key.id()
+            added[name] = added.get(name, 0) + 1
+        counters.incrementCounters(added)
+        return len(new_regs)
+
+
+@register
+class SessionEndTimes(Migration):
+    """Store the end time of Sessions from before endTime was introduced"""
+    name = 'session_end_times'
+
+    def query(self):
+        return Session.query()
+
+    def migrate(self, sessions):
+        changed = []
+        for session in sessions:
+            if session.startTime and not session.endTime:
+                session.endTime = (
+                    datetime.combine(datetime.min, session.startTime) +
+                    timedelta(minutes=session.duration or 0)).time()
+                changed.append(session)
+        return changed
+
+
+@register
+class ConferenceAggregates(Migration):
+    """Count Conferences from before the aggregates in them
+
+    Every conference is marked as counted in its own transaction, which
+    has it counted by a task that commits with it.
+    """
+    name = 'conference_aggregates'
+
+    def query(self):
+        return Conference.query()
+
+    def migrateBatch(self, conferences):
+        @ndb.transactional
+        def mark(conf_key):
+            conf = conf_key.get()
+            if not conf or conf.aggregated:
+                return None
+            conf.aggregated = True
+            conf.put()
+            ConferenceApi._queueAggregates(
+                ConferenceApi._getAggregateDeltas(
+                    conf, 1, conf.seatsAvailable or 0), conf)
+            return conf
+
+        counted = [conf for conf in
+                   (mark(conf.key) for conf in conferences
+                    if not conf.aggregated)
+                   if conf]
+        return len(counted)
+
+
+@register
+class ConferenceArchiveFlags(Migration):
+    """Store the archived flag of Conferences from before it existed
+
+    Entities without the property aren't in its index, so the queries
+    that leave out archived conferences wouldn't find them.
+    """
+    name = 'conference_archive_flags'
+
+    def query(self):
+        return Conference.query()
+
+    def migrate(self, conferences):
+        return [conf for conf in conferences
+                if 'archived' not in conf._values]
+
+
+@register
+class SessionArchiveFlags(Migration):
+    """Store the archived flag of Sessions from before it existed"""
+    name = 'session_archive_flags'
+
+    def query(self):
+        return Session.query()
+
+    def migrate(self, sessions):
+        return [session for session in sessions
+                if 'archived' not in session._values]
+
+
+@register
+class WishlistCounts(Migration):
+    """Count Wishlist entries from before the wishlist counters
+
+    Every entry is marked as counted in its own transaction, and is counted
+    once that has committed; entries removed in the mean time aren't
+    brought back, and a task that fails in between leaves them out of the
+    counters (rather than counting them twice).
+    """
+    name = 'wishlist_counts'
+
+    def query(self):
+        return Wishlist.query()
+
+    def migrateBatch(self, wishlists):
+        @ndb.transactional
+        def mark(wishlist_key):
+            wishlist = wishlist_key.get()
+            if not wishlist or wishlist.counted:
+                return None
+            wishlist.counted = True
+            wishlist.put()
+            return wishlist
+
+        uncounted = [wishlist for wishlist in
+                     (mark(wishlist.key) for wishlist in wishlists
+                      if not wishlist.counted)
+                     if wishlist]
+        added = {}
+        for wishlist in uncounted:
+            name = WISHLIST_COUNTER % wishlist.session.urlsafe()
+            added[name] = added.get(name, 0) + 1
+        counters.incrementCounters(added, WISHLIST_COUNTER_SHARDS)
+        return len(uncounted)
+
+
+class UpdatedTimestamps(Migration):
+    """Store the updated timestamp of entities from before it existed
+
+    Entities without the property aren't in its index, so the changes feed
+    wouldn't find them. Putting them sets it to the time of the put.
+    """
+    model = None
+
+    def query(self):
+        return self.model.query()
+
+    def migrate(self, entities):
+        return [entity for entity in entities
+                if 'updated' not in entity._values]
+
+
+@register
+class ConferenceUpdated(UpdatedTimestamps):
+    name = 'conference_updated'
+    model = Conference
+
+
+@register
+class SessionUpdated(UpdatedTimestamps):
+    name = 'session_updated'
+    model = Session
+
+
+@register
+class SpeakerUpdated(UpdatedTimestamps):
+    name = 'speaker_updated'
+    model = Speaker
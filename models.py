@@ -15,6 +15,7 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 import httplib
 import endpoints
 from protorpc import messages
+from protorpc import remote
 from google.appengine.ext import ndb
 
 
@@ -23,12 +24,75 @@ class ConflictException(endpoints.ServiceException):
     http_status = httplib.CONFLICT
 
 
+class TooManyRequestsException(endpoints.ServiceException):
+    """Exception mapped to HTTP 429 response"""
+    http_status = 429
+
+    def __init__(self, message=None):
+        # httplib has no name for 429, which ServiceException looks up
+        remote.ApplicationError.__init__(self, message, 'Too Many Requests')
+
+
 class Profile(ndb.Model):
     """User profile object"""
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    conferenceKeysToAttend = ndb.KeyProperty(kind='Conference', repeated=True,
+                                             name='conferenceKeys')
+    # registrations as websafe strings, as they were stored before; moved
+    # to conferenceKeysToAttend by migrateRegistrations()
+    legacyConferenceKeysToAttend = ndb.StringProperty(
+        repeated=True, name='conferenceKeysToAttend')
+
+    _attending = None
+
+    def _attendingSet(self):
+        if self._attending is None:
+            self._attending = set(self.conferenceKeysToAttend)
+        return self._attending
+
+    def isAttending(self, conf_key):
+        """Return whether the Conference key is registered (in O(1))"""
+        return conf_key in self._attendingSet()
+
+    def addConference(self, conf_key):
+        """Register a Conference key"""
+        self.conferenceKeysToAttend.append(conf_key)
+        self._attendingSet().add(conf_key)
+
+    def removeConference(self, conf_key):
+        """Unregister a Conference key"""
+        self.conferenceKeysToAttend.remove(conf_key)
+        self._attendingSet().discard(conf_key)
+
+    def migrateRegistrations(self):
+        """Move legacy websafe string registrations to Conference keys
+
+        Returns whether the profile changed (and has to be put).
+        """
+        if not self.legacyConferenceKeysToAttend:
+            return False
+        for wsck in self.legacyConferenceKeysToAttend:
+            conf_key = ndb.Key(urlsafe=wsck)
+            if not self.isAttending(conf_key):
+                self.addConference(conf_key)
+        self.legacyConferenceKeysToAttend = []
+        return True
+
+
+class Registration(ndb.Model):
+    """Registration of a Profile (parent) for a Conference, keyed by the
+    Conference's websafe key"""
+    conference = ndb.KeyProperty(kind='Conference')
+    registered = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class WaitlistEntry(ndb.Model):
+    """Place of a Profile (parent) on the waitlist of a sold out Conference,
+    keyed by the Conference's websafe key"""
+    conference = ndb.KeyProperty(kind='Conference')
+    added      = ndb.DateTimeProperty(auto_now_add=True)
 
 
 class ProfileMiniForm(messages.Message):
@@ -43,11 +107,15 @@ class ProfileForm(messages.Message):
     mainEmail = messages.StringField(2)
     teeShirtSize = messages.EnumField('TeeShirtSize', 3)
     conferenceKeysToAttend = messages.StringField(4, repeated=True)
+    etag = messages.StringField(5)
+    notModified = messages.BooleanField(6)
 
 
 class StringMessage(messages.Message):
     """Outbound message for (single) string"""
     data = messages.StringField(1, required=True)
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)
 
 
 class BooleanMessage(messages.Message):
@@ -55,6 +123,22 @@ class BooleanMessage(messages.Message):
     data = messages.BooleanField(1)
 
 
+class RegistrationMessage(messages.Message):
+    """Outbound message for the result of a (un)registration"""
+    data       = messages.BooleanField(1)
+    waitlisted = messages.BooleanField(2)
+
+
+class WebsafeKeysMessage(messages.Message):
+    """Inbound message for a list of websafe keys"""
+    websafeKeys = messages.StringField(1, repeated=True)
+
+
+class IntegerMessage(messages.Message):
+    """Outbound message for (single) integer"""
+    data = messages.IntegerField(1)
+
+
 class Conference(ndb.Model):
     """Conference object"""
     name            = ndb.StringProperty(required=True)
@@ -67,6 +151,14 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    # whether the conference is counted in the aggregates
+    aggregated      = ndb.BooleanProperty(default=False, indexed=False)
+    # ended conferences are archived, and left out of the hot queries
+    archived        = ndb.BooleanProperty(default=False)
+    # last write, for the changes feed
+    updated         = ndb.DateTimeProperty(auto_now=True)
+    # deleted conferences are removed (with their sessions) by tasks
+    deleted         = ndb.BooleanProperty(default=False, indexed=False)
 
 
 class ConferenceForm(messages.Message):
@@ -83,11 +175,49 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10)
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
 
 
 class ConferenceForms(messages.Message):
     """Outbound form message for multiple Conference messages"""
-    items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    items   = messages.MessageField(ConferenceForm, 1, repeated=True)
+    # JSON description of how queryConferences ran, when asked for
+    explain = messages.StringField(2)
+
+
+class DashboardForm(messages.Message):
+    """Outbound form message for everything the client shows on load"""
+    conferencesToAttend = messages.MessageField(ConferenceForm, 2,
+                                                repeated=True)
+    announcement        = messages.StringField(3)
+    conferences         = messages.MessageField(ConferenceForm, 4,
+                                                repeated=True)
+
+
+class ConferenceResultForm(messages.Message):
+    """Outbound form message for one Conference of a batch get"""
+    websafeKey = messages.StringField(1)
+    conference = messages.MessageField(ConferenceForm, 2)
+    error      = messages.StringField(3)
+
+
+class ConferenceResultForms(messages.Message):
+    """Outbound form message for a batch get of Conferences, in the order
+    of the requested keys"""
+    items = messages.MessageField(ConferenceResultForm, 1, repeated=True)
+
+
+class ConferenceStatForm(messages.Message):
+    """Outbound form message for the Conference aggregates of one value"""
+    value          = messages.StringField(1)
+    conferences    = messages.IntegerField(2)
+    seatsAvailable = messages.IntegerField(3)
+
+
+class ConferenceStatForms(messages.Message):
+    """Outbound form message for Conference aggregates per value"""
+    items = messages.MessageField(ConferenceStatForm, 1, repeated=True)
 
 
 class Session(ndb.Model):
@@ -100,6 +230,10 @@ class Session(ndb.Model):
     startTime       = ndb.TimeProperty()
     endTime         = ndb.TimeProperty()
     speakers        = ndb.KeyProperty(kind='Speaker', repeated=True)
+    # archived along with its conference
+    archived        = ndb.BooleanProperty(default=False)
+    # last write, for the changes feed
+    updated         = ndb.DateTimeProperty(auto_now=True)
 
 
 class SessionForm(messages.Message):
@@ -113,11 +247,62 @@ class SessionForm(messages.Message):
     startTime       = messages.StringField(6)
     speakers        = messages.StringField(7, repeated=True)
     websafeKey      = messages.StringField(8)
+    endTime         = messages.StringField(9)
+    speakerSummaries = messages.MessageField('SpeakerMiniForm', 10,
+                                             repeated=True)
 
 
 class SessionForms(messages.Message):
     """Outbound form message for multiple Session messages"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)
+
+
+class SessionResultForm(messages.Message):
+    """Outbound form message for one Session of a batch get"""
+    websafeKey = messages.StringField(1)
+    session    = messages.MessageField(SessionForm, 2)
+    error      = messages.StringField(3)
+
+
+class SessionResultForms(messages.Message):
+    """Outbound form message for a batch get of Sessions, in the order of
+    the requested keys"""
+    items = messages.MessageField(SessionResultForm, 1, repeated=True)
+
+
+class SpeakerEditForm(messages.Message):
+    """Inbound form message to add or remove a Speaker of a Session"""
+    websafeSessionKey = messages.StringField(1, required=True)
+    websafeSpeakerKey = messages.StringField(2, required=True)
+    add               = messages.BooleanField(3, default=True)
+
+
+class SpeakerEditForms(messages.Message):
+    """Inbound form message for multiple SpeakerEditForm messages"""
+    edits = messages.MessageField(SpeakerEditForm, 1, repeated=True)
+
+
+class SessionConflictForm(messages.Message):
+    """Outbound form message for a group of overlapping Sessions"""
+    sessions = messages.MessageField(SessionForm, 1, repeated=True)
+
+
+class SessionConflictForms(messages.Message):
+    """Outbound form message for multiple SessionConflictForm messages"""
+    items = messages.MessageField(SessionConflictForm, 1, repeated=True)
+
+
+class Timetable(ndb.Model):
+    """Serialized timetable of a Conference, keyed by its websafe key"""
+    data = ndb.TextProperty()
+
+
+class TopSessions(ndb.Model):
+    """Serialized most wishlisted Sessions of a Conference, keyed by its
+    websafe key"""
+    data = ndb.TextProperty()
 
 
 class Speaker(ndb.Model):
@@ -125,6 +310,8 @@ class Speaker(ndb.Model):
     name    = ndb.StringProperty(required=True)
     twitter = ndb.StringProperty()
     website = ndb.StringProperty()
+    # last write, for the changes feed
+    updated = ndb.DateTimeProperty(auto_now=True)
 
 
 class SpeakerForm(messages.Message):
@@ -135,14 +322,46 @@ class SpeakerForm(messages.Message):
     websafeKey  = messages.StringField(4)
 
 
+class SpeakerMiniForm(messages.Message):
+    """Outbound form message for a Speaker, as embedded in SessionForm"""
+    name        = messages.StringField(1)
+    twitter     = messages.StringField(2)
+    websafeKey  = messages.StringField(3)
+
+
 class SpeakerForms(messages.Message):
     """Outbound form message for multiple Speaker messages"""
     items = messages.MessageField(SpeakerForm, 1, repeated=True)
 
 
+class Tombstone(ndb.Model):
+    """Deleted Conference, Session or Speaker, for the changes feed"""
+    kind       = ndb.StringProperty(indexed=False)
+    websafeKey = ndb.StringProperty(indexed=False)
+    deleted    = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class DeletedForm(messages.Message):
+    """Outbound form message for a deleted entity"""
+    kind       = messages.StringField(1)
+    websafeKey = messages.StringField(2)
+
+
+class ChangesForm(messages.Message):
+    """Outbound form message for the changes since a token"""
+    conferences = messages.MessageField(ConferenceForm, 1, repeated=True)
+    sessions    = messages.MessageField(SessionForm, 2, repeated=True)
+    speakers    = messages.MessageField(SpeakerForm, 3, repeated=True)
+    deleted     = messages.MessageField(DeletedForm, 4, repeated=True)
+    token       = messages.StringField(5)
+    more        = messages.BooleanField(6)
+
+
 class Wishlist(ndb.Model):
     """Wishlist object"""
     session = ndb.KeyProperty(kind=Session)
+    # whether the entry is counted in the wishlist counter of its session
+    counted = ndb.BooleanProperty(default=False, indexed=False)
 
 
 class WishlistForm(messages.Message):
@@ -183,6 +402,19 @@ class SessionType(messages.Enum):
     SOCIAL_EVENT = 9
 
 
+class AttendeeForm(messages.Message):
+    """Outbound form message for an attendee of a Conference"""
+    displayName = messages.StringField(1)
+    mainEmail   = messages.StringField(2)
+    registered  = messages.StringField(3)
+
+
+class AttendeeForms(messages.Message):
+    """Outbound form message for a page of AttendeeForm messages"""
+    items         = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
 class ConferenceQueryForm(messages.Message):
     """Inbound form message for Conference query"""
     field       = messages.StringField(1)
@@ -192,4 +424,24 @@ class ConferenceQueryForm(messages.Message):
 
 class ConferenceQueryForms(messages.Message):
     """Inbound form message for multiple ConferenceQueryForm messages"""
-    filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    filters         = messages.MessageField(ConferenceQueryForm, 1,
+                                            repeated=True)
+    includeArchived = messages.BooleanField(2)
+    # return how the query ran, in ConferenceForms.explain
+    explain         = messages.BooleanField(3)
+
+
+class SessionQueryForm(messages.Message):
+    """Inbound form message for Session query"""
+    field       = messages.StringField(1)
+    operator    = messages.StringField(2)
+    value       = messages.StringField(3)
+
+
+class SessionQueryForms(messages.Message):
+    """Inbound form message for multiple SessionQueryForm messages"""
+    filters         = messages.MessageField(SessionQueryForm, 1,
+                                            repeated=True)
+    includeArchived = messages.BooleanField(2)
+    limit           = messages.IntegerField(3,
+                                            variant=messages.Variant.INT32)
@@ -16,3 +16,12 @@ WEB_CLIENT_ID = '795810892321-t4kv2l93crch7kdorp0b98vgvu3tokn0.apps.googleuserco
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Token buckets per caller of rate limited ConferenceApi methods, as
+# (calls, per seconds): a caller may burst up to calls, and gets calls
+# back per seconds; methods that aren't listed aren't limited.
+RATE_LIMITS = {
+    'queryConferences': (30, 60),
+    'getDashboard': (30, 60),
+    'getConferenceSessions': (60, 60),
+}
@@ -130,3 +130,50 @@ app.factory('oauth2Provider', function ($modal) {
 
     return oauth2Provider;
 });
+
+/**
+ * @ngdoc service
+ * @name dashboard
+ *
+ * @description
+ * Service that holds the dashboard data loaded by the conferences page, so other pages can use it
+ * without calling the API again. conferencesToAttend stays null until the dashboard has been loaded.
+ *
+ */
+app.factory('dashboard', function () {
+    var dashboard = {
+        conferencesToAttend: null
+    };
+
+    /**
+     * Returns whether the user attends a conference, or null when the dashboard hasn't been loaded.
+     */
+    dashboard.isAttending = function (websafeConferenceKey) {
+        if (!dashboard.conferencesToAttend) {
+            return null;
+        }
+        for (var i = 0; i < dashboard.conferencesToAttend.length; i++) {
+            if (dashboard.conferencesToAttend[i].websafeKey == websafeConferenceKey) {
+                return true;
+            }
+        }
+        return false;
+    };
+
+    /**
+     * Adds or removes a conference from the conferences to attend, after (un)registering.
+     */
+    dashboard.setAttending = function (conference, attending) {
+        if (!dashboard.conferencesToAttend) {
+            return;
+        }
+        dashboard.conferencesToAttend = dashboard.conferencesToAttend.filter(function (item) {
+            return item.websafeKey != conference.websafeKey;
+        });
+        if (attending) {
+            dashboard.conferencesToAttend.push(conference);
+        }
+    };
+
+    return dashboard;
+});
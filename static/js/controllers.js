@@ -249,7 +249,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, dashboard, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -293,6 +293,19 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.conferences = [];
 
+    /**
+     * Holds the announcement and the conferences the user will attend, as loaded by getDashboard.
+     * conferencesToAttend stays null until the dashboard has been loaded.
+     */
+    $scope.announcement = '';
+    $scope.conferencesToAttend = null;
+
+    /**
+     * Holds the status if the dashboard has been loaded.
+     * @type {boolean}
+     */
+    $scope.dashboardLoaded = false;
+
     /**
      * Holds the state if offcanvas is enabled.
      *
@@ -305,6 +318,11 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.tabAllSelected = function () {
         $scope.selectedTab = 'ALL';
+        if (!$scope.dashboardLoaded && oauth2Provider.signedIn) {
+            // On load, get everything in a single round trip.
+            $scope.getDashboard();
+            return;
+        }
         $scope.queryConferences();
     };
 
@@ -329,6 +347,14 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             oauth2Provider.showLoginModal();
             return;
         }
+        if ($scope.conferencesToAttend) {
+            // Loaded by getDashboard already.
+            $scope.conferences = $scope.conferencesToAttend;
+            $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
+            $scope.alertStatus = 'success';
+            $scope.submitted = true;
+            return;
+        }
         $scope.queryConferences();
     };
 
@@ -427,19 +453,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      * Invokes the conference.queryConferences API.
      */
     $scope.queryConferencesAll = function () {
-        var sendFilters = {
-            filters: []
-        }
-        for (var i = 0; i < $scope.filters.length; i++) {
-            var filter = $scope.filters[i];
-            if (filter.field && filter.operator && filter.value) {
-                sendFilters.filters.push({
-                    field: filter.field.enumValue,
-                    operator: filter.operator.enumValue,
-                    value: filter.value
-                });
-            }
-        }
+        var sendFilters = $scope.getSendFilters();
         $scope.loading = true;
         gapi.client.conference.queryConferences(sendFilters).
             execute(function (resp) {
@@ -468,6 +482,57 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             });
     }
 
+    /**
+     * Returns the complete filters in the form the API expects them.
+     */
+    $scope.getSendFilters = function () {
+        var sendFilters = {
+            filters: []
+        }
+        for (var i = 0; i < $scope.filters.length; i++) {
+            var filter = $scope.filters[i];
+            if (filter.field && filter.operator && filter.value) {
+                sendFilters.filters.push({
+                    field: filter.field.enumValue,
+                    operator: filter.operator.enumValue,
+                    value: filter.value
+                });
+            }
+        }
+        return sendFilters;
+    };
+
+    /**
+     * Invokes the conference.getDashboard API, which returns the conferences to attend, the announcement
+     * and the queried conferences at once.
+     */
+    $scope.getDashboard = function () {
+        var sendFilters = $scope.getSendFilters();
+        $scope.loading = true;
+        gapi.client.conference.getDashboard(sendFilters).
+            execute(function (resp) {
+                $scope.$apply(function () {
+                    $scope.loading = false;
+                    if (resp.error) {
+                        // The request has failed; fall back to querying the conferences only.
+                        var errorMessage = resp.error.message || '';
+                        $log.error('Failed to get the dashboard : ' + errorMessage);
+                        $scope.dashboardLoaded = true;
+                        $scope.queryConferencesAll();
+                        return;
+                    }
+                    // The request has succeeded.
+                    $scope.dashboardLoaded = true;
+                    $scope.submitted = true;
+                    $scope.announcement = resp.result.announcement || '';
+                    $scope.conferencesToAttend = resp.result.conferencesToAttend || [];
+                    dashboard.conferencesToAttend = $scope.conferencesToAttend.slice();
+                    $scope.conferences = resp.result.conferences || [];
+                    $log.info('Dashboard loaded');
+                });
+            });
+    };
+
     /**
      * Invokes the conference.getConferencesCreated method.
      */
@@ -547,7 +612,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, dashboard, HTTP_ERRORS) {
     $scope.conference = {};
 
     $scope.isUserAttending = false;
@@ -579,8 +644,18 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
             });
         });
 
-        $scope.loading = true;
         // If the user is attending the conference, updates the status message and available function.
+        var attending = dashboard.isAttending($routeParams.websafeConferenceKey);
+        if (attending !== null) {
+            // Known from the dashboard the conferences page loaded.
+            if (attending) {
+                $scope.alertStatus = 'info';
+                $scope.messages = 'You are attending this conference';
+                $scope.isUserAttending = true;
+            }
+            return;
+        }
+        $scope.loading = true;
         gapi.client.conference.getProfile().execute(function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
@@ -624,12 +699,17 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                         return;
                     }
                 } else {
-                    if (resp.result) {
+                    if (resp.result.waitlisted) {
+                        // Sold out; the user has been put on the waitlist.
+                        $scope.messages = 'The conference is sold out; you have been put on its waitlist';
+                        $scope.alertStatus = 'info';
+                    } else if (resp.result) {
                         // Register succeeded.
                         $scope.messages = 'Registered for the conference';
                         $scope.alertStatus = 'success';
                         $scope.isUserAttending = true;
                         $scope.conference.seatsAvailable = $scope.conference.seatsAvailable - 1;
+                        dashboard.setAttending($scope.conference, true);
                     } else {
                         $scope.messages = 'Failed to register for the conference';
                         $scope.alertStatus = 'warning';
@@ -666,6 +746,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                         $scope.alertStatus = 'success';
                         $scope.conference.seatsAvailable = $scope.conference.seatsAvailable + 1;
                         $scope.isUserAttending = false;
+                        dashboard.setAttending($scope.conference, false);
                         $log.info($scope.messages);
                     } else {
                         var errorMessage = resp.error.message || '';
@@ -1,9 +1,15 @@
+import contextlib
 import json
 import os
+import threading
 import time
 
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import urlfetch
 
+_rpc_counts = threading.local()
+_rpc_hook_installed = []
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -32,3 +38,32 @@ def getUserId(user, id_type="email"):
                 time.sleep(wait)
                 wait = wait + i
         return user.get('user_id', '')
+
+
+def _countRpc(service, call, request, response):
+    counts = getattr(_rpc_counts, 'counts', None)
+    if counts is not None:
+        name = '%s.%s' % (service, call)
+        counts[name] = counts.get(name, 0) + 1
+
+
+@contextlib.contextmanager
+def countRpcs():
+    """Count the API calls this thread makes in a with block, per call
+
+    Yields the dict the counts (like {'datastore_v3.RunQuery': 1}) are
+    added to.
+    """
+    if not _rpc_hook_installed:
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'rpc_counter', _countRpc)
+        _rpc_hook_installed.append(True)
+    outer = getattr(_rpc_counts, 'counts', None)
+    counts = _rpc_counts.counts = {}
+    try:
+        yield counts
+    finally:
+        _rpc_counts.counts = outer
+        if outer is not None:
+            for name, count in counts.items():
+                outer[name] = outer.get(name, 0) + count